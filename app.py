@@ -1,52 +1,94 @@
+import asyncio
 import json
+import logging
 import os
-from typing import Any
+import threading
+from concurrent.futures import CancelledError, Executor, Future, wait
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
 
-import requests
 import streamlit as st
 from dotenv import find_dotenv, load_dotenv
-from huggingface_hub import login
-from langchain.chains import LLMChain
-from langchain.document_loaders import UnstructuredURLLoader
-from langchain.prompts import PromptTemplate
-from langchain.text_splitter import CharacterTextSplitter
-from linkedin_api import Linkedin
 
+from utils.async_runner import PipelineCancelled, StageGraph, as_coroutine, raise_if_cancelled
+from utils.cache import StageCache, cached_call, content_hash, normalise_query, serper_cache, serper_flight, \
+    linkedin_profile_cache, linkedin_profile_flight, page_cache, page_flight, stage_cache
+from utils.chunking import prepare_chunks
+from utils.concurrency import BackendGate, backend_gate, backend_limits, ordered_map
 from utils.custom import css_code
+from utils.fetch import FETCH_MAX_WORKERS, FETCH_TIMEOUT, Transport, fetch_documents, http_session
 from utils.helper import get_keywords, cities, salaries, models, ui_spacer, ui_info, ui_progress_bar, progress_bar_map, \
-    model_validator
+    model_validator, model_backend, start_model_warm_up, compact_profile, get_linkedin_client, stream_tokens, \
+    ui_executor, ui_job, ui_session_id, register_prompt_prefix
+from utils.job_index import index_job_pages, job_index
 from utils.messages import welcome_message, header_message, side_bar_temperature_message, side_bar_max_tokens_message
+from utils.progress import PipelineProgress, run_stage
+from utils.prompting import URL_SELECTION_MAX_TOKENS, compact_search_results, completion_token_limit, count_tokens, \
+    dedupe_domains, extract_organic_results, log_prompt_tokens, prompt_token_budget
+from utils.ranking import is_ambiguous, posting_matches, rank_job_results, salary_band
+from utils.registry import model_registry
+from utils.structured import select_urls
+from utils.telemetry import configure_metrics_logging, external_call, metrics, record_cache, record_event, \
+    record_llm_call, request_trace, start_metrics_server, traced
+from utils.work_queue import QueueFull, pipeline_queue
 
 # ---------loading credentials--------- #
 load_dotenv(find_dotenv())
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
 LINKEDIN_USERNAME = os.getenv("LINKEDIN_USERNAME")
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")
+WARM_UP_MODELS = [model for model in os.getenv("WARM_UP_MODELS", "").split(",") if model]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1500"))
+LLM_VERBOSE = os.getenv("LLM_VERBOSE", "false").lower() == "true"
+MAX_JOB_URLS = 2
+QUEUE_POLL_SECONDS = 0.5
+NO_MATCHING_JOBS_MESSAGE = "No job postings matched the location, radius and salary you chose."
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
-# ---------huggingface login--------- #
-login(token=HUGGINGFACE_API_TOKEN)
+logger = logging.getLogger(__name__)
 
-# ---------linkedin client--------- #
-linkedin_client: Any = Linkedin(LINKEDIN_USERNAME, LINKEDIN_PASSWORD)
+# ---------credentials each backend needs, checked when a job is submitted rather than at start-up--------- #
+required_credentials: dict = {
+    "openai": ["OPENAI_API_KEY"],
+    "huggingface": ["HUGGINGFACE_API_TOKEN"],
+    "pipeline": ["SERPAPI_API_KEY", "LINKEDIN_USERNAME", "LINKEDIN_PASSWORD"],
+}
+
+# ---------model warm-up off the main thread, engines are kept in the process-wide registry across reruns--------- #
+start_model_warm_up(tuple(WARM_UP_MODELS))
+
+# ---------metrics log lines (request traces, prompt tokens) and prometheus endpoint, set up once per process--------- #
+configure_metrics_logging()
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
 
 
 # ------------------getting user information via the LinkedIn API------------------ #
-def get_linkedin_profile(client: Any, username: str) -> dict[str, str]:
+@traced("get_linkedin_profile")
+def get_linkedin_profile(client: Optional[Any], username: str) -> dict[str, str]:
     """
-    This function is used to get the profile of the specified user
-    :param client: LinkedIn client
+    This function is used to get the profile of the specified user, profiles are cached in compact form
+    by username and the client only authenticates on the first cache miss
+    :param client: LinkedIn client, None uses the shared lazily created client
     :param username: LinkedIn username
     :return: user profile dict
     """
-    profile: dict = client.get_profile(username)
-    print(profile)
+    def fetch_profile() -> dict:
+        with backend_gate("linkedin"), external_call("linkedin"):
+            return compact_profile((client or get_linkedin_client()).get_profile(username))
+
+    profile: dict = cached_call(linkedin_profile_cache, linkedin_profile_flight,
+                                key=username.strip().lower(), function=fetch_profile, name="linkedin_profile")
+    logger.debug("LinkedIn profile: %s", profile)
 
     return profile
 
 
 # ------------------find the most relevant keywords & data to improve the search------------------ #
+@traced("get_job_related_keywords")
 def get_job_related_keywords(linkedin_profile_dict: dict, keyword: str) -> str:
     """
     This function is used to retrieve all the job related keywords from a user profile
@@ -61,101 +103,229 @@ def get_job_related_keywords(linkedin_profile_dict: dict, keyword: str) -> str:
         return get_keywords(keyword, linkedin_profile_dict)
 
 
-def job_search_sentence_generator(linkedin_profile_dict: dict) -> str:
+def get_profile_keywords(linkedin_profile_dict: dict) -> list[str]:
+    """
+    This function is used to collect the profile keywords used to rank the job search results
+    :param linkedin_profile_dict: returned LinkedIn profile data
+    :return: list of profile keywords
+    """
+    industries: Any = get_job_related_keywords(linkedin_profile_dict, "most_recent_industry") or []
+    profile_keywords: list = [get_job_related_keywords(linkedin_profile_dict, "most_recent_job_title"),
+                              get_job_related_keywords(linkedin_profile_dict, "most_recent_degree"),
+                              *(industries if isinstance(industries, list) else [industries])]
+
+    return [keyword for keyword in profile_keywords if keyword]
+
+
+@traced("generate_job_search_query")
+def job_search_sentence_generator(linkedin_profile_dict: dict, location: Optional[str] = None) -> str:
     """
     This function is used to generate a sentence that will be used as a job search query
     :param linkedin_profile_dict: returned LinkedIn profile data
+    :param location: location from the form, the profile location is used without one
     :return: job search sentence
     """
+    job_location: str = location or get_job_related_keywords(linkedin_profile_dict, 'current_location')
     job_search_sentence: str = (f"{get_job_related_keywords(linkedin_profile_dict, 'most_recent_job_title')} "
-                                f"jobs in {get_job_related_keywords(linkedin_profile_dict, 'current_location')}")
+                                f"jobs in {job_location}")
 
     return job_search_sentence
 
 
+# ------------------answering the job search from the local job index------------------ #
+@traced("lookup_job_index")
+def lookup_indexed_jobs(query: str, location: Optional[str] = None, salary: Optional[str] = None,
+                        radius: Optional[float] = None) -> list:
+    """
+    This function is used to look for fresh postings matching the query in the local job index, so a search
+    similar to an earlier one doesn't go back to Serper and the job sites
+    :param query: query used to search
+    :param location: location from the form
+    :param salary: salary from the form
+    :param radius: radius (km) from the form
+    :return: list of posting documents, empty on a miss
+    """
+    # a miss while the index is still being opened, so a cold start doesn't run into the stage timeout
+    index: Any = job_index(wait=False)
+    if index is None:
+        return []
+
+    try:
+        documents: list = index.find_postings(query, count=MAX_JOB_URLS, location=location,
+                                              band=salary_band(salary), radius_km=radius)
+    except Exception as error:
+        # the index only saves work, a failing lookup falls back to the web search
+        logger.warning("Job index lookup failed: %s", error)
+        documents: list = []
+    record_cache("job_index", hit=bool(documents))
+    return documents
+
+
 # ------------------using serpapi to search for jobs using keywords------------------ #
+@traced("search_for_job_roles")
 def serp_search_for_jobs(query: str) -> dict:
     """
-    This function is used to search for jobs using the serpapi
+    This function is used to search for jobs using the serpapi, responses are cached by the normalised query
+    and identical in-flight searches share a single upstream call
     :param query: query used to search
     :return: dict of search results
     """
-    url = "https://google.serper.dev/search"
-    payload = json.dumps({
-        "q": query
-    })
-    headers = {
-        "X-API-KEY": SERPAPI_API_KEY,
-        "Content-Type": "application/json"
-    }
-    response: Any = requests.request("POST", url, headers=headers, data=payload)
-    response_data: dict = response.json()
+    url = SERPER_URL
+    normalised_query: str = normalise_query(query)
+
+    def search() -> dict:
+        payload = json.dumps({
+            "q": normalised_query
+        })
+        headers = {
+            "X-API-KEY": SERPAPI_API_KEY,
+            "Content-Type": "application/json"
+        }
+        with backend_gate("serper"), external_call("serper"):
+            response: Any = http_session().post(url, headers=headers, data=payload, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    response_data: dict = cached_call(serper_cache, serper_flight, key=normalised_query, function=search,
+                                     name="serper")
 
     return response_data
 
 
 # ------------------prompt template and the gpt-3.5-turbo model------------------ #
-def find_the_best_job_search_url(response_data: dict, query: str, temperature: Any, model: Any) -> list:
+@traced("find_the_best_job_urls")
+def find_the_best_job_search_url(response_data: dict, query: str, temperature: Any, model: Any,
+                                 keywords: Optional[list[str]] = None, location: Optional[str] = None,
+                                 salary: Optional[str] = None, max_tokens: Optional[int] = None) -> list:
     """
-    This function is used to find the best job url using a prompt template and the gpt-3.5-turbo model
+    This function is used to find the best job url, the organic results are ranked locally first and
+    the prompt template and model are only used when the ranking is ambiguous
     :param response_data: dictionary of job search results
     :param query: query used to search for jobs
     :param temperature: randomness of model output
     :param model: generative model
+    :param keywords: profile keywords used by the local ranking
+    :param location: location from the form
+    :param salary: salary from the form
+    :param max_tokens: max number of tokens from the sidebar, not applied to this internal call
     :return: list of the top job url
     """
-    response_str = json.dumps(response_data)
+    ranked: list[tuple[float, dict]] = rank_job_results(
+        results=dedupe_domains(extract_organic_results(response_data)),
+        keywords=keywords or [query], location=location, salary=salary)
+    ranked_urls: list[str] = [result["link"] for _, result in ranked[:2]]
+
+    if not is_ambiguous(ranked):
+        record_event("url_selection_total", method="ranking")
+        logger.debug("Ranked job urls: %s", ranked_urls)
+        return ranked_urls
+
     prompt_template: str = """
     You're a world class job recruiter, and are very good at finding the most relevant jobs for certain topics;
     {response_str}
     Above is a list of search results for the query {query}.
     Please choose the best jobs from the list, return ONLY an array of the top two urls, do not include anything else;
     """
+    # the sidebar limit is meant for the prose, a reply cut below URL_SELECTION_MAX_TOKENS can't be read
+    completion_tokens: int = completion_token_limit(model, URL_SELECTION_MAX_TOKENS)
+    # only the organic results that fit the model context are sent to the model
+    budget: int = prompt_token_budget(model=model, template=prompt_template.replace("{query}", query),
+                                      completion_tokens=completion_tokens)
+    # the results are sent best ranked first, so a budget cut drops the weakest ones
+    response_str, _ = compact_search_results(response_data=response_data, query=query, model=model, budget=budget,
+                                             ranked_results=[result for _, result in ranked])
+    prompt: str = prompt_template.format(response_str=response_str, query=query)
+    log_prompt_tokens("find_the_best_job_search_url", prompt, model=model)
+
     # logic for which model is passed in
 
-    model_call: Any = model_validator(model=model, temperature=temperature)
+    model_call: Any = model_validator(model=model, temperature=temperature, max_tokens=completion_tokens)
 
     llm: Any = model_call
 
-    prompt: PromptTemplate = PromptTemplate(template=prompt_template, input_variables=["response_str", "query"])
-
-    job_finder: Any = LLMChain(llm=llm, prompt=prompt, verbose=True)
+    register_prompt_prefix(llm, prompt_template)
 
-    generated_urls = job_finder.predict(response_str=response_str, query=query)
+    # the model may only choose among the results it was shown, best ranked first
+    candidates: list[str] = [result["link"] for _, result in ranked if result["link"] in response_str]
 
-    url_list = json.loads(generated_urls)
-    print(url_list)
+    record_event("url_selection_total", method="model")
+    url_list: Optional[list] = select_urls(llm, model=model, prompt=prompt, candidates=candidates,
+                                           count=MAX_JOB_URLS)
+    if not url_list:
+        # the local ranking is used whenever the model reply isn't a usable array, even after the repair call
+        url_list = ranked_urls
+    logger.debug("Job urls: %s", url_list)
 
     return url_list
 
 
 # ------------------data extraction from the job urls------------------ #
-def get_job_content_from_urls(urls: list) -> list:
+@traced("get_content_from_urls")
+def get_job_content_from_urls(urls: list, transport: Optional[Transport] = None) -> list:
     """
-    This is a function is used to fetch the data from the passed in url list
+    This is a function is used to fetch the data from the passed in url list,
+    pages are downloaded concurrently and parsed in a process pool. Pages are cached by url,
+    so a url shared by several searches is only fetched once, and every fetched page is added to the job index
     :param urls: job urls
+    :param transport: optional callable used to download the pages
     :return: list of extracted data
     """
-    loader = UnstructuredURLLoader(urls=urls)
-    data = loader.load()
+    def fetch_and_index(url: str) -> list:
+        documents: list = fetch_documents(urls=[url], transport=transport)
+        index_job_pages(documents)
+        return documents
+
+    def fetch_page(url: str) -> list:
+        return cached_call(page_cache, page_flight, key=url, function=lambda: fetch_and_index(url),
+                           cache_if=bool, name="job_page")
+
+    pages: list[list] = ordered_map(fetch_page, urls, max_workers=FETCH_MAX_WORKERS)
+    data: list = [document for page in pages for document in page]
 
     return data
 
 
+def filter_job_postings(data: list, location: Optional[str] = None, salary: Optional[str] = None,
+                        radius: Optional[float] = None) -> list:
+    """
+    This function is used to drop fetched postings outside the salary band or the radius around the location,
+    so they aren't summarised
+    :param data: fetched job data
+    :param location: location from the form
+    :param salary: salary from the form
+    :param radius: radius (km) from the form
+    :return: job data that passes the filters
+    """
+    kept: list = [document for document in data
+                  if posting_matches(document.page_content, location=location, salary=salary, radius_km=radius)]
+    if len(kept) < len(data):
+        metrics.inc("postings_filtered_total", len(data) - len(kept))
+        logger.debug("Filtered out %d of %d postings", len(data) - len(kept), len(data))
+    return kept
+
+
 # ------------------prompt template and the gpt-3.5-turbo model------------------ #
-def summarise_the_job_content(data: list, query: str, temperature: Any, model: Any) -> list[str]:
+@traced("summarise_content")
+def summarise_the_job_content(data: list, query: str, temperature: Any, model: Any,
+                              seen_data: Optional[list] = None, max_tokens: Optional[int] = None,
+                              cancel_event: Optional[threading.Event] = None) -> list[str]:
     """
-    This function is used to summarise the fetched job data using the gpt-3.5-turbo and prompt template
+    This function is used to summarise the fetched job data using the gpt-3.5-turbo and prompt template.
+    Boilerplate and near-duplicate chunks are removed first, so fewer model calls are made
     :param data: job data to summarise
     :param query: query used for the job search
     :param temperature: randomness of model output
     :param model: generative model
+    :param seen_data: job data summarised by another call, chunks duplicating it are skipped
+    :param max_tokens: max number of tokens per summary
+    :param cancel_event: optional cancel event of the run, checked between chunks
     :return: list of summarised job specific text
     """
-    text_splitter = CharacterTextSplitter(separator="\n", chunk_size=3000, chunk_overlap=200, length_function=len)
-    text = text_splitter.split_documents(data)
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
 
-    model_call: Any = model_validator(model=model, temperature=temperature)
+    completion_tokens: int = completion_token_limit(model, max_tokens)
+    model_call: Any = model_validator(model=model, temperature=temperature, max_tokens=completion_tokens)
 
     llm: Any = model_call
 
@@ -174,32 +344,67 @@ def summarise_the_job_content(data: list, query: str, temperature: Any, model: A
 
     prompt: PromptTemplate = PromptTemplate(template=prompt_template, input_variables=["text", "query"])
 
-    llm_summariser: Any = LLMChain(llm=llm, prompt=prompt, verbose=True)
-
-    summaries: list = []
-
-    for chunk in enumerate(text):
-        print(chunk)
-        summary = llm_summariser.predict(text=chunk, query=query)
-        summaries.append(summary)
-
-    print(summaries)
+    chunk_tokens: int = min(CHUNK_MAX_TOKENS, prompt_token_budget(model=model, template=prompt_template,
+                                                                  completion_tokens=completion_tokens))
+    text, _ = prepare_chunks(documents=data, max_tokens=chunk_tokens,
+                             count=partial(count_tokens, model=model), seen_documents=seen_data)
+
+    llm_summariser: Any = LLMChain(llm=llm, prompt=prompt, verbose=LLM_VERBOSE)
+
+    backend: str = model_backend(model)
+    gate: BackendGate = backend_gate(backend)
+
+    if backend == "huggingface":
+        # the local pipeline generates a whole batch of chunks in one call instead of one call per chunk
+        batch_size: int = backend_limits["huggingface"]["batch_size"]
+        summaries: list = []
+        for start in range(0, len(text), batch_size):
+            raise_if_cancelled(cancel_event)
+            with gate, external_call(backend):
+                results: list[dict] = llm_summariser.apply([{"text": chunk.page_content, "query": query}
+                                                            for chunk in text[start:start + batch_size]])
+            summaries += [result[llm_summariser.output_key] for result in results]
+    else:
+        def summarise_chunk(chunk: Any) -> str:
+            raise_if_cancelled(cancel_event)
+            with external_call(backend):
+                return llm_summariser.predict(text=chunk.page_content, query=query)
+
+        summaries: list = ordered_map(summarise_chunk, text, max_workers=gate.concurrency, gate=gate)
+
+    for chunk, summary in zip(text, summaries):
+        record_llm_call(model, prompt.format(text=chunk.page_content, query=query), summary)
+    logger.debug("Summaries: %s", summaries)
     return summaries
 
 
 # ------------------prompt template and the gpt-3.5-turbo model------------------ #
-def generate_the_job_list(summaries: list, query: str, temperature: Any, model: Any) -> str:
+@traced("generate_job_list")
+def generate_the_job_list(summaries: list, query: str, temperature: Any, model: Any,
+                          on_token: Optional[Callable[[str], None]] = None, max_tokens: Optional[int] = None,
+                          cancel_event: Optional[threading.Event] = None) -> str:
     """
     This function is used to feed the summaries into an LLM, to generate job posts using a prompt template
     :param summaries: summarised job text
     :param query: query used for the job search
     :param temperature: randomness of model output
     :param model: generative model
+    :param on_token: optional callback receiving the job post text as it is generated
+    :param max_tokens: max number of tokens of the job post
+    :param cancel_event: optional cancel event of the run, checked while the job post is streamed
     :return: generated job posts
     """
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+
+    if not summaries:
+        # nothing passed the location, radius and salary filters, so there is nothing to write about
+        return NO_MATCHING_JOBS_MESSAGE
+
     summaries_str = str(summaries)
 
-    model_call: Any = model_validator(model=model, temperature=temperature)
+    model_call: Any = model_validator(model=model, temperature=temperature,
+                                      max_tokens=completion_token_limit(model, max_tokens))
 
     llm: Any = model_call
 
@@ -219,13 +424,279 @@ def generate_the_job_list(summaries: list, query: str, temperature: Any, model:
 
     prompt: PromptTemplate = PromptTemplate(template=prompt_template, input_variables=["summaries_str", "query"])
 
-    job_post_chain: Any = LLMChain(llm=llm, prompt=prompt, verbose=True)
+    if on_token is not None:
+        job_post: str = ""
+        with backend_gate(model_backend(model)), external_call(model_backend(model)):
+            for token in stream_tokens(llm, prompt.format(summaries_str=summaries_str, query=query)):
+                raise_if_cancelled(cancel_event)
+                job_post += token
+                on_token(token)
+        record_llm_call(model, prompt.format(summaries_str=summaries_str, query=query), job_post)
+        return job_post
 
-    job_post: Any = job_post_chain.predict(summaries_str=summaries_str, query=query)
+    job_post_chain: Any = LLMChain(llm=llm, prompt=prompt, verbose=LLM_VERBOSE)
+
+    with backend_gate(model_backend(model)), external_call(model_backend(model)):
+        job_post: Any = job_post_chain.predict(summaries_str=summaries_str, query=query)
+    record_llm_call(model, prompt.format(summaries_str=summaries_str, query=query), job_post)
 
     return job_post
 
 
+# ------------------end-to-end pipeline------------------ #
+def is_job_post(job_post: str) -> bool:
+    """
+    This helper function is used to keep empty outputs out of the stage cache: pipeline stages cache only
+    non-empty results (bool), and the job post isn't cached when nothing was found to write about, so a
+    failed fetch isn't replayed from the cache for the whole TTL
+    :param job_post: generated job post
+    :return: whether the job post is worth caching
+    """
+    return bool(job_post) and job_post != NO_MATCHING_JOBS_MESSAGE
+
+
+def run_pipeline(username: Optional[str], model: Any, temperature: Any, location: Optional[str] = None,
+                 salary: Optional[str] = None, progress: Optional[PipelineProgress] = None,
+                 cache: StageCache = stage_cache, on_token: Optional[Callable[[str], None]] = None,
+                 profile: Optional[dict] = None, linkedin_client: Any = None, radius: Optional[float] = None,
+                 max_tokens: Optional[int] = None) -> dict:
+    """
+    This function is used to run every pipeline stage for a LinkedIn user. Each stage output is memoised by
+    a hash of its inputs and model settings, so a rerun only recomputes the stages downstream of a change
+    :param username: LinkedIn username, ignored when a profile is passed in
+    :param model: generative model
+    :param temperature: randomness of model output
+    :param location: location from the form
+    :param salary: salary from the form
+    :param progress: optional progress tracker
+    :param cache: stage cache
+    :param on_token: optional callback streaming the job post as it is generated
+    :param profile: optional raw LinkedIn profile used instead of looking the username up
+    :param linkedin_client: optional LinkedIn client, defaults to the shared client
+    :param radius: radius (km) from the form
+    :param max_tokens: max number of completion tokens per model call, capped per backend
+    :return: dict of stage results
+    """
+    def stage(name: str, function: Any, params: Optional[dict] = None, cache_if: Callable[[Any], bool] = bool,
+              **inputs: Any) -> Any:
+        return run_stage(progress, name, partial(cache.memoise, name, function, params, cache_if), **inputs)
+
+    with request_trace(model=model, mode="sync"):
+        model_params: dict = {"model": model, "temperature": round(float(temperature), 2), "max_tokens": max_tokens}
+        result: dict = {}
+
+        if profile is not None:
+            result["profile"] = compact_profile(profile)
+        else:
+            result["profile"] = stage("get_linkedin_profile", partial(get_linkedin_profile, client=linkedin_client),
+                                      username=username)
+
+        result["keywords"] = stage("get_job_related_keywords", get_job_related_keywords,
+                                   linkedin_profile_dict=result["profile"], keyword="most_recent_job_title")
+
+        result["query"] = stage("generate_job_search_query", job_search_sentence_generator,
+                                linkedin_profile_dict=result["profile"], location=location)
+
+        # the index isn't memoised, its answer changes as postings are added and go stale
+        indexed: list = lookup_indexed_jobs(query=result["query"], location=location, salary=salary, radius=radius)
+
+        if indexed:
+            # postings found in the job index skip the web search and the page downloads
+            for name in ("search_for_job_roles", "find_the_best_job_urls", "get_content_from_urls"):
+                run_stage(progress, name, lambda: None)
+            result["search"] = {}
+            result["urls"] = [document.metadata["source"] for document in indexed]
+            result["content"] = indexed
+        else:
+            result["search"] = stage("search_for_job_roles", serp_search_for_jobs, query=result["query"])
+
+            result["urls"] = stage("find_the_best_job_urls", find_the_best_job_search_url, params=model_params,
+                                   response_data=result["search"], query=result["query"],
+                                   keywords=get_profile_keywords(result["profile"]), location=location,
+                                   salary=salary)
+
+            result["content"] = filter_job_postings(
+                stage("get_content_from_urls", get_job_content_from_urls, urls=result["urls"]),
+                location=location, salary=salary, radius=radius)
+
+        result["summaries"] = stage("summarise_content", summarise_the_job_content, params=model_params,
+                                    data=result["content"], query=result["query"])
+
+        # the token callback isn't part of the cache key, a cached job post is returned whole
+        result["job_post"] = stage("generate_job_list", partial(generate_the_job_list, on_token=on_token),
+                                   params=model_params, cache_if=is_job_post, summaries=result["summaries"],
+                                   query=result["query"])
+
+        return result
+
+
+# ------------------coroutine versions of the pipeline functions------------------ #
+aget_linkedin_profile = as_coroutine(get_linkedin_profile)
+aget_job_related_keywords = as_coroutine(get_job_related_keywords)
+ajob_search_sentence_generator = as_coroutine(job_search_sentence_generator)
+aserp_search_for_jobs = as_coroutine(serp_search_for_jobs)
+afind_the_best_job_search_url = as_coroutine(find_the_best_job_search_url)
+aget_job_content_from_urls = as_coroutine(get_job_content_from_urls)
+asummarise_the_job_content = as_coroutine(summarise_the_job_content)
+agenerate_the_job_list = as_coroutine(generate_the_job_list)
+
+# ------------------stage timeouts (seconds)------------------ #
+stage_timeouts: dict = {
+    "warm_up_model": float(os.getenv("WARM_UP_TIMEOUT", "900")),
+    "get_linkedin_profile": 60,
+    "lookup_job_index": 60,
+    "search_for_job_roles": 60,
+    "find_the_best_job_urls": 180,
+    "get_content_from_urls": 90,
+    "summarise_content": 600,
+    "generate_job_list": 600,
+}
+
+
+async def run_pipeline_async(username: Optional[str], model: Any, temperature: Any, location: Optional[str] = None,
+                             salary: Optional[str] = None, progress: Optional[PipelineProgress] = None,
+                             cache: StageCache = stage_cache, on_token: Optional[Callable[[str], None]] = None,
+                             profile: Optional[dict] = None, executor: Optional[Executor] = None,
+                             cancel_event: Optional[threading.Event] = None, linkedin_client: Any = None,
+                             radius: Optional[float] = None, max_tokens: Optional[int] = None) -> dict:
+    """
+    This function is used to run the pipeline as a dependency graph, so independent work overlaps:
+    the model loads while LinkedIn and Serper are called, and each job url is fetched and summarised
+    on its own as soon as it is ready. Stage outputs go through the same stage cache as run_pipeline
+    :param username: LinkedIn username, ignored when a profile is passed in
+    :param model: generative model
+    :param temperature: randomness of model output
+    :param location: location from the form
+    :param salary: salary from the form
+    :param progress: optional progress tracker
+    :param cache: stage cache
+    :param on_token: optional callback streaming the job post as it is generated
+    :param profile: optional raw LinkedIn profile used instead of looking the username up
+    :param executor: optional executor running the blocking stage functions
+    :param cancel_event: optional event, setting it stops the pipeline (e.g. when the user resubmits)
+    :param linkedin_client: optional LinkedIn client, defaults to the shared client
+    :param radius: radius (km) from the form
+    :param max_tokens: max number of completion tokens per model call, capped per backend
+    :return: dict of stage results, with the same keys as run_pipeline
+    """
+    graph: StageGraph = StageGraph(executor=executor, progress=progress, cancel_event=cancel_event)
+    model_params: dict = {"model": model, "temperature": round(float(temperature), 2), "max_tokens": max_tokens}
+
+    def cached(name: str, function: Any, params: Optional[dict] = None, cache_if: Callable[[Any], bool] = bool,
+               **inputs: Any) -> Any:
+        return graph.call(cache.memoise, name, function, params, cache_if, **inputs)
+
+    async def warm_up(_: dict) -> Any:
+        # same engine settings as the summary and job post stages, so they find the warmed engine
+        return await graph.call(model_validator, model=model, temperature=temperature,
+                                max_tokens=completion_token_limit(model, max_tokens))
+
+    async def linkedin_profile(_: dict) -> dict:
+        if profile is not None:
+            return compact_profile(profile)
+        return await cached("get_linkedin_profile", partial(get_linkedin_profile, client=linkedin_client),
+                            username=username)
+
+    async def keywords(results: dict) -> str:
+        return await cached("get_job_related_keywords", get_job_related_keywords,
+                            linkedin_profile_dict=results["profile"], keyword="most_recent_job_title")
+
+    async def query(results: dict) -> str:
+        return await cached("generate_job_search_query", job_search_sentence_generator,
+                            linkedin_profile_dict=results["profile"], location=location)
+
+    async def indexed(results: dict) -> list:
+        return await graph.call(lookup_indexed_jobs, query=results["query"], location=location, salary=salary,
+                                radius=radius)
+
+    async def search(results: dict) -> dict:
+        if results["index"]:
+            return {}
+        return await cached("search_for_job_roles", serp_search_for_jobs, query=results["query"])
+
+    async def urls(results: dict) -> list:
+        if results["index"]:
+            return [document.metadata["source"] for document in results["index"]]
+        return await cached("find_the_best_job_urls", find_the_best_job_search_url, params=model_params,
+                            response_data=results["search"], query=results["query"],
+                            keywords=get_profile_keywords(results["profile"]), location=location, salary=salary)
+
+    def fetch(index: int) -> Callable[[dict], Awaitable[list]]:
+        async def fetch_url(results: dict) -> list:
+            if index >= len(results["urls"]):
+                return []
+            if results["index"]:
+                return results["index"][index:index + 1]
+            data: list = await cached("get_content_from_urls", get_job_content_from_urls,
+                                      urls=results["urls"][index:index + 1])
+            return filter_job_postings(data, location=location, salary=salary, radius=radius)
+        return fetch_url
+
+    def summarise(index: int) -> Callable[[dict], Awaitable[list]]:
+        async def summarise_url(results: dict) -> list:
+            if not results[f"content:{index}"]:
+                return []
+            # earlier pages are passed in so their near duplicates aren't summarised twice
+            seen_data: list = [document for earlier in range(index) for document in results[f"content:{earlier}"]]
+            return await cached("summarise_content",
+                                partial(summarise_the_job_content, cancel_event=graph.cancel_event),
+                                params=model_params, data=results[f"content:{index}"], query=results["query"],
+                                seen_data=seen_data)
+        return summarise_url
+
+    async def job_post(results: dict) -> str:
+        summaries: list = [summary for index in range(MAX_JOB_URLS) for summary in results[f"summaries:{index}"]]
+        return await cached("generate_job_list",
+                            partial(generate_the_job_list, on_token=on_token, cancel_event=graph.cancel_event),
+                            params=model_params, cache_if=is_job_post, summaries=summaries, query=results["query"])
+
+    graph.add("model", warm_up, timeout=stage_timeouts["warm_up_model"])
+    graph.add("profile", linkedin_profile, timeout=stage_timeouts["get_linkedin_profile"],
+              progress_key="get_linkedin_profile")
+    graph.add("keywords", keywords, deps=("profile",), progress_key="get_job_related_keywords")
+    graph.add("query", query, deps=("profile",), progress_key="generate_job_search_query")
+    graph.add("index", indexed, deps=("query",), timeout=stage_timeouts["lookup_job_index"])
+    graph.add("search", search, deps=("query", "index"), timeout=stage_timeouts["search_for_job_roles"],
+              progress_key="search_for_job_roles")
+    graph.add("urls", urls, deps=("search", "profile"), timeout=stage_timeouts["find_the_best_job_urls"],
+              progress_key="find_the_best_job_urls")
+    for index in range(MAX_JOB_URLS):
+        graph.add(f"content:{index}", fetch(index), deps=("urls", "index"),
+                  timeout=stage_timeouts["get_content_from_urls"], progress_key="get_content_from_urls")
+        graph.add(f"summaries:{index}", summarise(index),
+                  deps=tuple(f"content:{earlier}" for earlier in range(index + 1)) + ("model",),
+                  timeout=stage_timeouts["summarise_content"], progress_key="summarise_content")
+    graph.add("job_post", job_post, deps=tuple(f"summaries:{index}" for index in range(MAX_JOB_URLS)),
+              timeout=stage_timeouts["generate_job_list"], progress_key="generate_job_list")
+
+    with request_trace(model=model, mode="async") as trace:
+        results: dict = await graph.run()
+
+    return {
+        "profile": results["profile"],
+        "keywords": results["keywords"],
+        "query": results["query"],
+        "search": results["search"],
+        "urls": results["urls"],
+        "content": [document for index in range(MAX_JOB_URLS) for document in results[f"content:{index}"]],
+        "summaries": [summary for index in range(MAX_JOB_URLS) for summary in results[f"summaries:{index}"]],
+        "job_post": results["job_post"],
+        "trace": trace,
+    }
+
+
+# ------------------credential check------------------ #
+def missing_credentials(model: Any) -> list[str]:
+    """
+    This function is used to list the credentials a run with the model needs but that aren't set, so a
+    misconfigured app fails on submit with a clear message instead of at start-up or half way through a run
+    :param model: generative model
+    :return: names of the missing environment variables
+    """
+    names: list[str] = required_credentials["pipeline"] + required_credentials[model_backend(model)]
+    return [name for name in names if not os.getenv(name)]
+
+
 # ------------------streamlit------------------ #
 def _streamlit() -> None:
     """
@@ -236,6 +707,9 @@ def _streamlit() -> None:
 
     st.markdown(css_code, unsafe_allow_html=True)
 
+    # the job index is opened in the background while the form is filled in, not on the first search
+    job_index(wait=False)
+
     # ------------------sidebar------------------ #
     with st.sidebar:
         st.image("img/webworks87-light-logo.jpg")
@@ -257,7 +731,9 @@ def _streamlit() -> None:
             5, 1000, 500,
             help=side_bar_max_tokens_message
         )
-        ui_spacer(26)
+        ui_spacer(2)
+        show_metrics: bool = st.checkbox("Debug metrics", value=False)
+        ui_spacer(24)
         ui_info()
 
     # ------------------header & main paragraph------------------ #
@@ -285,36 +761,79 @@ def _streamlit() -> None:
     # ------------------passing main form & sidebar form variables to functions------------------ #
     if main_submit:
 
-        linkedin_profile_result: dict[str, str] = get_linkedin_profile(
-            client=linkedin_client, username=linkedin_profile)
-        ui_progress_bar(user_feedback=progress_bar_map.get("get_linkedin_profile"))
-
-        job_keywords_result: str = get_job_related_keywords(
-            linkedin_profile_dict=linkedin_profile_result, keyword="most_recent_job_title")
-        ui_progress_bar(user_feedback=progress_bar_map.get("get_job_related_keywords"))
-
-        job_search_generator_result: str = job_search_sentence_generator(linkedin_profile_dict=linkedin_profile_result)
-        ui_progress_bar(user_feedback=progress_bar_map.get("generate_job_search_query"))
-
-        serp_search_job_result: dict = serp_search_for_jobs(query=job_search_generator_result)
-        ui_progress_bar(user_feedback=progress_bar_map.get("search_for_job_roles"))
-
-        find_best_job_result: list = find_the_best_job_search_url(
-            response_data=serp_search_job_result, query=job_search_generator_result,
-            temperature=temperature, model=model)
-        ui_progress_bar(user_feedback=progress_bar_map.get("find_the_best_job_urls"))
-
-        get_job_content_result: list = get_job_content_from_urls(urls=find_best_job_result)
-        ui_progress_bar(user_feedback=progress_bar_map.get("get_content_from_urls"))
-
-        summarise_job_content_result: list[str] = summarise_the_job_content(
-            data=get_job_content_result, query=job_search_generator_result, temperature=temperature, model=model)
-        ui_progress_bar(user_feedback=progress_bar_map.get("summarise_content"))
-
-        generate_job_list_result: str = generate_the_job_list(
-            summaries=summarise_job_content_result, query=job_search_generator_result,
-            temperature=temperature, model=model)
-        ui_progress_bar(user_feedback=progress_bar_map.get("generate_job_list"))
+        missing: list[str] = missing_credentials(model)
+        if missing:
+            st.error(f"The job post generator isn't configured, set {', '.join(missing)} and restart the app.")
+            return
+
+        progress: PipelineProgress = PipelineProgress(stage_map=progress_bar_map, listeners=[ui_progress_bar()])
+
+        job_post_container: Any = st.expander("Generated job list results", expanded=True)
+        job_post_placeholder: Any = job_post_container.empty()
+        streamed_tokens: list[str] = []
+
+        def on_token(token: str) -> None:
+            streamed_tokens.append(token)
+            job_post_placeholder.info("".join(streamed_tokens))
+
+        # a resubmit gives up on the previous run of this session, the queue stops it once no session waits for it
+        previous_job: Optional[Future] = st.session_state.get("pipeline_job")
+        if previous_job is not None:
+            pipeline_queue.release(previous_job)
+        cancel_event: threading.Event = threading.Event()
+
+        def run_job() -> dict:
+            executor: Executor = ui_executor()
+            try:
+                return asyncio.run(run_pipeline_async(
+                    username=linkedin_profile, model=model, temperature=temperature, location=location,
+                    salary=salary, progress=progress, on_token=on_token, executor=executor, cancel_event=cancel_event,
+                    radius=radius, max_tokens=max_tokens))
+            finally:
+                # a cancelled or timed out run returns right away, stages still running stop at their next
+                # cancel check instead of holding the work queue slot
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        # sessions asking for the same result share one run on the work queue
+        job_key: str = content_hash(linkedin_profile.strip().lower(), model, round(float(temperature), 2), max_tokens,
+                                    location, salary, radius)
+        session_id: str = ui_session_id()
+        try:
+            job: Future = pipeline_queue.submit(session=session_id, key=job_key, function=ui_job(run_job),
+                                                cancel_event=cancel_event)
+        except QueueFull as error:
+            st.warning(f"The job post generator is busy ({error}).")
+            return
+        st.session_state["pipeline_job"] = job
+
+        queue_status: Any = st.empty()
+        while not job.done():
+            position: Optional[int] = pipeline_queue.position(job)
+            if position is not None:
+                queue_status.info(f"Waiting for a free model slot, position {position} in the queue...")
+            elif pipeline_queue.is_shared(job, session_id):
+                # the stage progress of a shared run is only shown to the session that submitted it
+                queue_status.info("The same search is already running for another user, the job list will show "
+                                  "here when it is ready...")
+            else:
+                queue_status.empty()
+            wait([job], timeout=QUEUE_POLL_SECONDS)
+        queue_status.empty()
+
+        try:
+            pipeline_result: dict = job.result()
+        except (PipelineCancelled, CancelledError):
+            st.info("This run was stopped because the form was submitted again.")
+            return
+
+        linkedin_profile_result: dict[str, str] = pipeline_result["profile"]
+        job_keywords_result: str = pipeline_result["keywords"]
+        job_search_generator_result: str = pipeline_result["query"]
+        serp_search_job_result: dict = pipeline_result["search"]
+        find_best_job_result: list = pipeline_result["urls"]
+        get_job_content_result: list = pipeline_result["content"]
+        summarise_job_content_result: list[str] = pipeline_result["summaries"]
+        generate_job_list_result: str = pipeline_result["job_post"]
 
         # ------------------UI output------------------ #
         # with st.expander("LinkedIn profile"):
@@ -331,8 +850,15 @@ def _streamlit() -> None:
         #     st.info(get_job_content_result)
         # with st.expander("Summarised job content results"):
         #     st.info(summarise_job_content_result)
-        with st.expander("Generated job list results"):
-            st.info(generate_job_list_result)
+        job_post_placeholder.info(generate_job_list_result)
+
+        # ------------------debug metrics------------------ #
+        if show_metrics:
+            with st.sidebar.expander("Debug metrics", expanded=True):
+                st.json(pipeline_result["trace"].to_dict())
+                st.json({"engines": model_registry.stats(), "stage_cache": stage_cache.stats(),
+                         "work_queue": pipeline_queue.stats()})
+                st.code(metrics.render_prometheus(), language="text")
 
 
 # ------------------main------------------ #
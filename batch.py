@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Iterator, Optional
+
+from app import run_pipeline
+from utils.cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------batch input------------------ #
+def read_batch_input(path: str) -> Iterator[dict]:
+    """
+    This function is used to read the batch input, each JSONL line is a username string,
+    {"username": ...}, {"profile": {...}} or a raw LinkedIn profile dict like test_data
+    :param path: input JSONL path
+    :return: iterator of batch items with an id and either a username or a profile
+    """
+    with open(path) as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record: Any = json.loads(line)
+            if isinstance(record, str):
+                record = {"username": record}
+            elif "experience" in record:
+                record = {"profile": record}
+
+            if "username" not in record and "profile" not in record:
+                raise ValueError(f"Line {line_number}: expected a username or a profile")
+
+            item_id: str = record.get("id") or record.get("username") or content_hash(record["profile"])[:16]
+            yield {"id": item_id, "username": record.get("username"), "profile": record.get("profile")}
+
+
+# ------------------checkpointing------------------ #
+def completed_ids(output_path: str) -> set[str]:
+    """
+    This function is used to read the ids already written successfully, so a crashed run can resume
+    :param output_path: output JSONL path, which doubles as the checkpoint
+    :return: set of completed ids
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    done: set[str] = set()
+    with open(output_path) as file:
+        for line in file:
+            try:
+                record: dict = json.loads(line)
+            except json.JSONDecodeError:
+                # a crash can leave a partial last line
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+class ResultWriter:
+    """
+    This class is used to append results to the output JSONL as soon as each profile finishes
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file: Any = open(path, "a")
+        self._lock: threading.Lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# ------------------batch run------------------ #
+def run_batch_item(item: dict, model: str, temperature: float, location: Optional[str],
+                   salary: Optional[str], radius: Optional[float] = None, max_tokens: Optional[int] = None) -> dict:
+    """
+    This function is used to run the pipeline for one batch item and turn the outcome into an output record
+    :param item: batch item
+    :param model: generative model
+    :param temperature: randomness of model output
+    :param location: location filter
+    :param salary: salary filter
+    :param radius: radius (km) around the location
+    :param max_tokens: max number of completion tokens per model call
+    :return: output record
+    """
+    start: float = time.perf_counter()
+    try:
+        result: dict = run_pipeline(username=item["username"], profile=item["profile"], model=model,
+                                    temperature=temperature, location=location, salary=salary, radius=radius,
+                                    max_tokens=max_tokens)
+    except Exception as error:
+        logger.exception("Batch item %s failed", item["id"])
+        return {"id": item["id"], "status": "error", "error": repr(error),
+                "elapsed": round(time.perf_counter() - start, 3)}
+
+    return {
+        "id": item["id"],
+        "status": "ok",
+        "username": item["username"],
+        "query": result["query"],
+        "urls": result["urls"],
+        "summaries": result["summaries"],
+        "job_post": result["job_post"],
+        "elapsed": round(time.perf_counter() - start, 3),
+    }
+
+
+def run_batch(input_path: str, output_path: str, model: str, temperature: float = 0.5,
+              location: Optional[str] = None, salary: Optional[str] = None, workers: int = 8,
+              radius: Optional[float] = None, max_tokens: Optional[int] = None) -> dict:
+    """
+    This function is used to generate job posts for every profile in the input file. Profiles fan out over a
+    worker pool, external services are capped by the shared backend gates, and shared queries, pages and
+    stage outputs are deduplicated by the caches the pipeline already uses
+    :param input_path: input JSONL path
+    :param output_path: output JSONL path, also used as the checkpoint
+    :param model: generative model
+    :param temperature: randomness of model output
+    :param location: location filter
+    :param salary: salary filter
+    :param workers: number of profiles processed at once
+    :param radius: radius (km) around the location
+    :param max_tokens: max number of completion tokens per model call
+    :return: run summary
+    """
+    done: set[str] = completed_ids(output_path)
+    seen: set[str] = set(done)
+    pending: list[dict] = []
+    for item in read_batch_input(input_path):
+        if item["id"] not in seen:
+            seen.add(item["id"])
+            pending.append(item)
+
+    logger.info("Batch: %d to run, %d already completed", len(pending), len(done))
+    summary: dict = {"skipped": len(done), "ok": 0, "error": 0}
+
+    writer: ResultWriter = ResultWriter(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures: list = [executor.submit(run_batch_item, item, model, temperature, location, salary, radius,
+                                             max_tokens)
+                             for item in pending]
+            for future in as_completed(futures):
+                record: dict = future.result()
+                writer.write(record)
+                summary[record["status"]] += 1
+    finally:
+        writer.close()
+
+    return summary
+
+
+# ------------------command line------------------ #
+def main() -> None:
+    """
+    Main function
+    :return: None
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Generate job posts for many profiles")
+    parser.add_argument("input", help="JSONL of usernames or LinkedIn profile dicts")
+    parser.add_argument("output", help="JSONL of results, rerun with the same path to resume")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--temperature", type=float, default=0.5)
+    parser.add_argument("--location", default=None)
+    parser.add_argument("--salary", default=None)
+    parser.add_argument("--radius", type=float, default=None, help="radius (km) around the location")
+    parser.add_argument("--max-tokens", type=int, default=None, help="max completion tokens per model call")
+    parser.add_argument("--workers", type=int, default=8)
+    args: argparse.Namespace = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary: dict = run_batch(input_path=args.input, output_path=args.output, model=args.model,
+                              temperature=args.temperature, location=args.location, salary=args.salary,
+                              workers=args.workers, radius=args.radius, max_tokens=args.max_tokens)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import copy
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from langchain.llms.base import LLM
+
+FIXTURES_DIR: Path = Path(__file__).parent / "fixtures"
+
+BENCHMARK_MODEL: str = "benchmark/deterministic-llm"
+
+
+# ------------------LinkedIn stand-in------------------ #
+class FakeLinkedinClient:
+    """
+    This class is used to answer get_profile with a copy of a recorded profile (test_data by default),
+    each username gets its own city so concurrent sessions search for different queries
+    """
+
+    def __init__(self, profile: dict, cities: list[str], latency_seconds: float = 0.0) -> None:
+        self.profile: dict = profile
+        self.cities: list[str] = cities
+        self.latency_seconds: float = latency_seconds
+
+    def get_profile(self, username: str) -> dict:
+        time.sleep(self.latency_seconds)
+        profile: dict = copy.deepcopy(self.profile)
+        city: str = self.cities[sum(map(ord, username)) % len(self.cities)]
+        for experience in profile.get("experience", []):
+            experience["locationName"] = city
+        return profile
+
+
+# ------------------model stand-in------------------ #
+class WhitespaceTokenizer:
+    """
+    This class is used to count tokens of the benchmark model, one token per whitespace separated word
+    """
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[str]:
+        return text.split()
+
+
+class DeterministicLLM(LLM):
+    """
+    This class is used to stand in for a generative model: the url prompt gets the first two urls of the
+    search results back as a JSON array, every other prompt gets its first words back. Latency is simulated
+    per call and per generated word so model bound stages keep a realistic share of the wall time
+    """
+
+    completion_words: int = 80
+    latency_seconds: float = 0.0
+    seconds_per_token: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic"
+
+    def complete(self, prompt: str) -> str:
+        links: list[str] = re.findall(r"https?://[^\s\"',\]\}]+", prompt)
+        if links and "array" in prompt.lower():
+            return json.dumps(list(dict.fromkeys(links))[:2])
+        return " ".join(prompt.split()[:self.completion_words])
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        completion: str = self.complete(prompt)
+        time.sleep(self.latency_seconds + self.seconds_per_token * len(completion.split()))
+        return completion
+
+
+def install_benchmark_model(latency_seconds: float = 0.0, seconds_per_token: float = 0.0) -> None:
+    """
+    This function is used to register the stand-in model and its tokenizer, so model_validator builds it
+    instead of loading weights. Completions are cut at the engine max_tokens, one word per token
+    :param latency_seconds: simulated seconds per call
+    :param seconds_per_token: simulated seconds per generated word
+    :return: None
+    """
+    from utils.helper import model_loaders
+    from utils.prompting import registered_tokenizers
+
+    def load(temperature: float, max_tokens: Optional[int]) -> DeterministicLLM:
+        return DeterministicLLM(completion_words=max_tokens or DeterministicLLM.__fields__["completion_words"].default,
+                                latency_seconds=latency_seconds, seconds_per_token=seconds_per_token)
+
+    registered_tokenizers[BENCHMARK_MODEL] = WhitespaceTokenizer()
+    model_loaders[BENCHMARK_MODEL] = load
+
+
+# ------------------Serper and job site stand-in------------------ #
+class FixtureServer:
+    """
+    This class is used to replay recorded responses on localhost: POST /search answers with the recorded
+    Serper response, and, used as an HTTP proxy, job page urls answer with their recorded html
+    """
+
+    def __init__(self, fixtures_dir: Path = FIXTURES_DIR, latency_seconds: float = 0.0) -> None:
+        self.search_response: bytes = (fixtures_dir / "serper_search.json").read_bytes()
+        page_files: dict = json.loads((fixtures_dir / "pages.json").read_text())
+        self.pages: dict[str, bytes] = {url: (fixtures_dir / "pages" / name).read_bytes()
+                                        for url, name in page_files.items()}
+        self.latency_seconds: float = latency_seconds
+        self.requests: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self) -> type:
+        fixture_server: FixtureServer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: bytes, content_type: str) -> None:
+                with fixture_server._lock:
+                    fixture_server.requests += 1
+                time.sleep(fixture_server.latency_seconds)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if urlparse(self.path).path == "/search":
+                    self._reply(200, fixture_server.search_response, "application/json")
+                else:
+                    self._reply(404, b"", "text/plain")
+
+            def do_GET(self) -> None:
+                # proxied requests carry the absolute url in the request line
+                url: str = self.path if self.path.startswith("http") else f"http://{self.headers['Host']}{self.path}"
+                page: Optional[bytes] = fixture_server.pages.get(url)
+                if page is None:
+                    self._reply(404, b"", "text/plain")
+                else:
+                    self._reply(200, page, "text/html; charset=utf-8")
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        This function is used to start serving on a free localhost port
+        :return: base url of the server
+        """
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
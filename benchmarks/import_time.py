@@ -0,0 +1,103 @@
+import argparse
+import json
+import logging
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR: Path = Path(__file__).resolve().parent.parent
+
+# backends that are imported on first use, importing the app must not pull them in
+LAZY_MODULES: tuple[str, ...] = ("transformers", "torch", "langchain", "huggingface_hub", "linkedin_api",
+                                 "unstructured", "sentence_transformers", "faiss")
+
+_importtime_line: re.Pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+# ------------------measurement------------------ #
+def measure_import(module: str) -> list[dict]:
+    """
+    This function is used to import a module in a fresh interpreter with -X importtime
+    :param module: module to import
+    :return: list of imports with their self and cumulative microseconds and nesting depth
+    """
+    completed: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    imports: list[dict] = []
+    for line in completed.stderr.splitlines():
+        match: Optional[re.Match] = _importtime_line.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({"module": name, "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                            "depth": len(indent) // 2})
+    return imports
+
+
+def import_report(imports: list[dict], top: int) -> dict:
+    """
+    This function is used to summarise an import trace: total time, slowest top-level imports and lazy
+    backends that were imported anyway
+    :param imports: output of measure_import
+    :param top: number of slowest imports listed
+    :return: import time report
+    """
+    top_level: list[dict] = [entry for entry in imports if entry["depth"] == 0]
+    slowest: list[dict] = sorted(top_level, key=lambda entry: entry["cumulative_us"], reverse=True)[:top]
+    eager: list[str] = sorted({entry["module"].split(".")[0] for entry in imports
+                               if entry["module"].split(".")[0] in LAZY_MODULES})
+    return {
+        "total_ms": round(sum(entry["cumulative_us"] for entry in top_level) / 1000, 1),
+        "modules": len(imports),
+        "slowest_ms": {entry["module"]: round(entry["cumulative_us"] / 1000, 1) for entry in slowest},
+        "eager_backends": eager,
+    }
+
+
+# ------------------main------------------ #
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    This function is used to check the cold import time of the app against a budget
+    :param argv: command line arguments
+    :return: exit code, 1 when the budget is exceeded or a lazy backend is imported eagerly
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Check the cold import time of the app")
+    parser.add_argument("--module", default="app", help="module to import")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="allowed import time in milliseconds")
+    parser.add_argument("--repeat", type=int, default=3, help="imports measured, the fastest one is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports listed")
+    parser.add_argument("--output", help="optional path the report is written to")
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # the fastest run is the one least disturbed by the disk cache and other processes
+    reports: list[dict] = [import_report(measure_import(args.module), top=args.top) for _ in range(args.repeat)]
+    report: dict = min(reports, key=lambda report_: report_["total_ms"])
+    report.update({"module": args.module, "budget_ms": args.budget_ms})
+
+    report_text: str = json.dumps(report, indent=2)
+    print(report_text)
+    if args.output:
+        Path(args.output).write_text(report_text + "\n")
+
+    failed: bool = False
+    if report["eager_backends"]:
+        logger.error("Importing %s imports %s, import them on first use", args.module,
+                     ", ".join(report["eager_backends"]))
+        failed = True
+    if report["total_ms"] > args.budget_ms:
+        logger.error("Importing %s took %.1f ms, over the %.1f ms budget", args.module, report["total_ms"],
+                     args.budget_ms)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from benchmarks.fakes import BENCHMARK_MODEL, FakeLinkedinClient, FixtureServer, install_benchmark_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE: Path = Path(__file__).parent / "baseline.json"
+TEMPERATURE: float = 0.5
+
+
+# ------------------statistics------------------ #
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    This helper function is used to read a percentile with linear interpolation
+    :param values: samples
+    :param fraction: percentile between 0 and 1
+    :return: percentile value
+    """
+    ordered: list[float] = sorted(values)
+    position: float = (len(ordered) - 1) * fraction
+    lower: int = int(position)
+    upper: int = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarise(values: list[float]) -> dict:
+    return {"mean": round(sum(values) / len(values), 4), "p50": round(percentile(values, 0.5), 4),
+            "p95": round(percentile(values, 0.95), 4), "max": round(max(values), 4)}
+
+
+# ------------------environment------------------ #
+def configure_environment(server_url: str, cache_dir: str, job_index: bool = False) -> None:
+    """
+    This function is used to point the app at the fixture server before it is imported: Serper is called on
+    the server and job pages are fetched through it as a proxy, caches go to a scratch directory
+    :param server_url: base url of the fixture server
+    :param cache_dir: scratch cache directory
+    :param job_index: use the job index, which needs the embedding model
+    :return: None
+    """
+    os.environ.update({
+        "SERPER_URL": f"{server_url}/search",
+        "SERPAPI_API_KEY": "benchmark",
+        "JOB_ROLE_CACHE_DIR": cache_dir,
+        "WARM_UP_MODELS": "",
+        "JOB_INDEX_ENABLED": "true" if job_index else "false",
+        "HTTP_PROXY": server_url,
+        "http_proxy": server_url,
+        "NO_PROXY": "127.0.0.1,localhost",
+        "no_proxy": "127.0.0.1,localhost",
+    })
+
+
+def clear_caches() -> None:
+    from utils.cache import linkedin_profile_cache, page_cache, serper_cache, stage_cache
+    from utils.job_index import job_index
+
+    for cache in (serper_cache, page_cache, linkedin_profile_cache, stage_cache.backend, job_index()):
+        if cache is not None:
+            cache.clear()
+
+
+# ------------------measurement------------------ #
+def run_session(username: str, mode: str, client: FakeLinkedinClient) -> dict:
+    """
+    This function is used to run the pipeline once and time it end to end and per stage
+    :param username: LinkedIn username of the session
+    :param mode: async (the stage graph used by the UI) or sync (the batch pipeline)
+    :param client: LinkedIn stand-in
+    :return: dict with the end to end seconds and the seconds of every stage
+    """
+    from app import run_pipeline, run_pipeline_async
+    from utils.helper import progress_bar_map
+    from utils.progress import PipelineProgress
+
+    progress: PipelineProgress = PipelineProgress(stage_map=progress_bar_map)
+    arguments: dict = {"username": username, "model": BENCHMARK_MODEL, "temperature": TEMPERATURE,
+                       "progress": progress, "linkedin_client": client}
+
+    start: float = time.perf_counter()
+    if mode == "async":
+        asyncio.run(run_pipeline_async(**arguments))
+    else:
+        run_pipeline(**arguments)
+    return {"seconds": time.perf_counter() - start, "stages": dict(progress.timings)}
+
+
+def run_benchmark(sessions: int, iterations: int, mode: str, warm: bool, client: FakeLinkedinClient) -> dict:
+    """
+    This function is used to run rounds of concurrent sessions and collect latency, throughput and memory
+    :param sessions: number of concurrent sessions per round
+    :param iterations: number of rounds
+    :param mode: async or sync
+    :param warm: keep the caches between rounds, otherwise every round starts cold
+    :param client: LinkedIn stand-in
+    :return: benchmark report
+    """
+    from utils.registry import resident_memory_bytes
+
+    runs: list[dict] = []
+    wall_seconds: float = 0.0
+    resident_before: int = resident_memory_bytes()
+    tracemalloc.start()
+
+    for iteration in range(iterations):
+        if not warm:
+            clear_caches()
+        start: float = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            runs += list(executor.map(lambda index: run_session(f"benchmark-user-{index}", mode, client),
+                                      range(sessions)))
+        wall_seconds += time.perf_counter() - start
+        logger.info("Round %d/%d done", iteration + 1, iterations)
+
+    _, peak_traced_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stage_names: list[str] = sorted({name for run in runs for name in run["stages"]})
+    return {
+        "config": {"sessions": sessions, "iterations": iterations, "mode": mode, "warm": warm},
+        "end_to_end": summarise([run["seconds"] for run in runs]),
+        "stages": {name: summarise([run["stages"][name] for run in runs if name in run["stages"]])
+                   for name in stage_names},
+        "throughput_per_second": round(len(runs) / wall_seconds, 4),
+        "peak_traced_bytes": peak_traced_bytes,
+        "resident_growth_bytes": resident_memory_bytes() - resident_before,
+    }
+
+
+# ------------------regression check------------------ #
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """
+    This function is used to list the metrics that got worse than the baseline by more than the tolerance,
+    latency changes smaller than min_delta seconds are treated as noise
+    :param report: current report
+    :param baseline: stored report
+    :param tolerance: allowed relative change, 0.2 is 20%
+    :param min_delta: smallest latency change in seconds worth reporting
+    :return: list of regression messages
+    """
+    checks: list[tuple[str, float, float, bool, float]] = [
+        ("end_to_end.p50", report["end_to_end"]["p50"], baseline["end_to_end"]["p50"], False, min_delta),
+        ("end_to_end.p95", report["end_to_end"]["p95"], baseline["end_to_end"]["p95"], False, min_delta),
+        ("throughput_per_second", report["throughput_per_second"], baseline["throughput_per_second"], True, 0.0),
+        ("peak_traced_bytes", report["peak_traced_bytes"], baseline["peak_traced_bytes"], False, 0.0),
+    ]
+    checks += [(f"stages.{name}.p50", stats["p50"], baseline["stages"][name]["p50"], False, min_delta)
+               for name, stats in report["stages"].items() if name in baseline["stages"]]
+
+    regressions: list[str] = []
+    for name, current, previous, higher_is_better, noise in checks:
+        change: float = previous - current if higher_is_better else current - previous
+        if change > previous * tolerance and change > noise:
+            regressions.append(f"{name}: {previous} -> {current}")
+    return regressions
+
+
+# ------------------main------------------ #
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    This function is used to run the benchmark offline against the recorded fixtures
+    :param argv: command line arguments
+    :return: exit code, 1 when a metric regressed against the baseline
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Benchmark the job post pipeline against recorded fixtures")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions per round")
+    parser.add_argument("--iterations", type=int, default=3, help="number of rounds")
+    parser.add_argument("--mode", choices=("async", "sync"), default="async")
+    parser.add_argument("--warm", action="store_true", help="keep caches between rounds")
+    parser.add_argument("--job-index", action="store_true", help="answer repeated searches from the job index")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="simulated seconds per model call")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="simulated seconds per generated word")
+    parser.add_argument("--network-latency", type=float, default=0.02, help="simulated seconds per http request")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="latency change in seconds treated as noise")
+    parser.add_argument("--output", help="optional path the report is written to")
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with FixtureServer(latency_seconds=args.network_latency) as server, tempfile.TemporaryDirectory() as cache_dir:
+        configure_environment(server.url, cache_dir, job_index=args.job_index)
+
+        from utils.helper import cities, test_data
+
+        install_benchmark_model(latency_seconds=args.llm_latency, seconds_per_token=args.token_latency)
+        client: FakeLinkedinClient = FakeLinkedinClient(profile=test_data, cities=cities,
+                                                        latency_seconds=args.network_latency)
+        report: dict = run_benchmark(sessions=args.sessions, iterations=args.iterations, mode=args.mode,
+                                     warm=args.warm, client=client)
+        report["config"].update({"llm_latency": args.llm_latency, "token_latency": args.token_latency,
+                                 "network_latency": args.network_latency, "job_index": args.job_index})
+        report["fixture_requests"] = server.requests
+
+    report_text: str = json.dumps(report, indent=2)
+    print(report_text)
+    if args.output:
+        Path(args.output).write_text(report_text + "\n")
+
+    baseline_path: Path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(report_text + "\n")
+        logger.info("Baseline written to %s", baseline_path)
+        return 0
+    if not baseline_path.exists():
+        logger.info("No baseline at %s, run with --update-baseline to store one", baseline_path)
+        return 0
+
+    baseline: dict = json.loads(baseline_path.read_text())
+    if baseline["config"] != report["config"]:
+        logger.warning("Baseline was recorded with %s, skipping the regression check", baseline["config"])
+        return 0
+
+    regressions: list[str] = compare_to_baseline(report, baseline, tolerance=args.tolerance,
+                                                 min_delta=args.min_delta)
+    for regression in regressions:
+        logger.error("Regression %s", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
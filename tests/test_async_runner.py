@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.async_runner import PipelineCancelled, StageGraph, StageTimeout, raise_if_cancelled
+
+
+class StageGraphTest(unittest.TestCase):
+    def test_timeout_stops_the_blocking_stage_thread(self) -> None:
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=2)
+        graph: StageGraph = StageGraph(executor=executor)
+        stopped: threading.Event = threading.Event()
+
+        def summarise() -> None:
+            try:
+                for _ in range(100):
+                    raise_if_cancelled(graph.cancel_event)
+                    time.sleep(0.05)
+            except PipelineCancelled:
+                stopped.set()
+                raise
+
+        async def summaries(_: dict) -> None:
+            return await graph.call(summarise)
+
+        graph.add("summaries", summaries, timeout=0.2)
+        with self.assertRaises(StageTimeout):
+            asyncio.run(graph.run())
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        self.assertTrue(graph.cancel_event.is_set())
+        self.assertTrue(stopped.wait(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from utils.chunking import repeated_lines_across, strip_boilerplate
+
+posting: str = """Home
+Jobs
+Accept all cookies
+
+Senior Data Engineer
+
+Requirements
+Python
+PyTorch
+Kubernetes
+
+You will build the data platform behind our recommendation models.
+Salary: £70,000 - £80,000
+
+Privacy policy
+"""
+
+
+class StripBoilerplateTest(unittest.TestCase):
+    def test_skill_bullets_headings_and_title_are_kept(self) -> None:
+        text: str = strip_boilerplate(posting)
+
+        for line in ("Senior Data Engineer", "Requirements", "Python", "PyTorch", "Kubernetes",
+                     "Salary: £70,000 - £80,000"):
+            self.assertIn(line, text.splitlines())
+        self.assertNotIn("Accept all cookies", text)
+        self.assertNotIn("Privacy policy", text)
+
+    def test_short_lines_repeated_across_pages_are_dropped(self) -> None:
+        other_page: str = "Home\nJobs\n\nJunior Analyst\nSQL"
+        text: str = strip_boilerplate(posting, repeated_lines_across([posting, other_page]))
+
+        self.assertNotIn("Home", text.splitlines())
+        self.assertNotIn("Jobs", text.splitlines())
+        self.assertIn("Python", text.splitlines())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import importlib.util
+import threading
+import unittest
+from unittest import mock
+
+
+@unittest.skipUnless(importlib.util.find_spec("streamlit"), "streamlit is not installed")
+class UiJobTest(unittest.TestCase):
+    def test_worker_thread_drops_the_session_context_after_the_job(self) -> None:
+        from streamlit.runtime.scriptrunner import SCRIPT_RUN_CONTEXT_ATTR_NAME, get_script_run_ctx
+
+        from utils import helper
+
+        session_context: object = object()
+        with mock.patch.object(helper, "get_script_run_ctx", return_value=session_context):
+            job = helper.ui_job(get_script_run_ctx)
+        contexts: dict = {}
+
+        def worker() -> None:
+            contexts["during"] = job()
+            contexts["after"] = getattr(threading.current_thread(), SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+        thread: threading.Thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(timeout=5)
+
+        self.assertIs(contexts["during"], session_context)
+        self.assertIsNone(contexts["after"])
+
+
+if __name__ == "__main__":
+    unittest.main()
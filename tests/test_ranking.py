@@ -0,0 +1,68 @@
+import importlib.util
+import json
+import unittest
+from pathlib import Path
+
+SERPER_FIXTURE: Path = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures" / "serper_search.json"
+# keywords get_profile_keywords reads from test_data, the profile the benchmark searches with
+PROFILE_KEYWORDS: list[str] = ["AI Software Engineer", "Computer Science", "Software"]
+
+
+@unittest.skipUnless(importlib.util.find_spec("streamlit"), "streamlit is not installed")
+class SalaryFilterTest(unittest.TestCase):
+    def test_find_salaries_reads_local_formats(self) -> None:
+        from utils.ranking import find_salaries
+
+        cases: dict[str, list[int]] = {
+            "£65,000 - £80,000": [65000, 80000],
+            "£65000 per annum": [65000],
+            "$120000 salary": [120000],
+            "$90k": [90000],
+            "€70.000 per year": [70000],
+            "70.000 € brutto": [70000],
+            "70 000 kr": [70000],
+            "NOK 650 000 per year": [650000],
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(find_salaries(text), expected)
+
+    def test_find_salaries_ignores_numbers_that_are_not_pay(self) -> None:
+        from utils.ranking import find_salaries
+
+        for text in ("12,500 employees", "We have 12 500 users", "founded in 2012", "£65.50 per hour"):
+            with self.subTest(text=text):
+                self.assertEqual(find_salaries(text), [])
+
+    def test_posting_matches_filters_on_salary_and_radius(self) -> None:
+        from utils.ranking import posting_matches
+
+        self.assertTrue(posting_matches("Data engineer in Paris, 70.000 € par an", "Paris", "60k-80k", 0))
+        self.assertFalse(posting_matches("Data engineer in Paris, 90.000 € salaire", "Paris", "60k-80k", 0))
+        self.assertFalse(posting_matches("Data engineer in London, £70,000", "Paris", "60k-80k", 100))
+        self.assertTrue(posting_matches("Data engineer, 12,500 employees", "Paris", "60k-80k", 0))
+
+
+
+@unittest.skipUnless(importlib.util.find_spec("streamlit"), "streamlit is not installed")
+class RankingTest(unittest.TestCase):
+    def test_recorded_search_is_ranked_without_the_model(self) -> None:
+        from utils.prompting import dedupe_domains, extract_organic_results
+        from utils.ranking import is_ambiguous, rank_job_results
+
+        results: list[dict] = dedupe_domains(extract_organic_results(json.loads(SERPER_FIXTURE.read_text())))
+        for location, salary in ((None, None), ("London", "60k-80k")):
+            with self.subTest(location=location, salary=salary):
+                ranked = rank_job_results(results, PROFILE_KEYWORDS, location=location, salary=salary)
+                self.assertFalse(is_ambiguous(ranked))
+
+    def test_weak_close_picks_are_left_to_the_model(self) -> None:
+        from utils.ranking import is_ambiguous
+
+        ranked: list = [(3.5, {}), (2.5, {}), (2.4, {})]
+        self.assertTrue(is_ambiguous(ranked))
+        self.assertFalse(is_ambiguous([(3.5, {}), (2.5, {}), (1.5, {})]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from utils.registry import ModelRegistry
+
+
+class ModelRegistryTest(unittest.TestCase):
+    def test_wrappers_and_clients_do_not_evict_shared_weights(self) -> None:
+        registry: ModelRegistry = ModelRegistry(max_engines=1)
+        weight_loads: list[str] = []
+
+        def local_engine(temperature: float) -> str:
+            def load_wrapper() -> str:
+                registry.get(("llama", None, None, None), loader=lambda: weight_loads.append("llama") or "weights",
+                             footprint=lambda weights: 300 * 1024 ** 2)
+                return "wrapper"
+            return registry.get(("llama", temperature, 100, None), loader=load_wrapper, lightweight=True)
+
+        local_engine(0.5)
+        for temperature in (0.1, 0.2, 0.3):
+            registry.get(("gpt-3.5-turbo", temperature, 100, None), loader=lambda: "client", lightweight=True)
+        local_engine(0.5)
+        local_engine(0.7)
+
+        self.assertEqual(weight_loads, ["llama"])
+        resident: dict = {stat["key"]: stat["resident_mb"] for stat in registry.stats()}
+        self.assertEqual(resident[("llama", None, None, None)], 300.0)
+        self.assertEqual(resident[("llama", 0.5, 100, None)], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import importlib.util
+import unittest
+
+CANDIDATES: list[str] = ["https://jobs.example.com/1", "https://jobs.example.com/2", "https://jobs.example.com/3"]
+
+
+class CharacterTokenizer:
+    eos_token_id: int = 0
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        return [ord(character) for character in text]
+
+
+class TokenIds(list):
+    def __getitem__(self, index):
+        item = super().__getitem__(index)
+        return TokenIds(item) if isinstance(index, slice) else item
+
+    def tolist(self) -> list[int]:
+        return list(self)
+
+
+@unittest.skipUnless(importlib.util.find_spec("streamlit"), "streamlit is not installed")
+class ExtractUrlListTest(unittest.TestCase):
+    def test_reads_fenced_chatty_object_and_bare_url_replies(self) -> None:
+        from utils.structured import extract_url_list
+
+        replies: dict[str, str] = {
+            "fenced": f'```json\n["{CANDIDATES[0]}", "{CANDIDATES[1]}"]\n```',
+            "chatty": f'Sure! The best jobs are ["{CANDIDATES[0]}", "{CANDIDATES[1]}"]. Good luck!',
+            "object": f'{{"urls": [{{"link": "{CANDIDATES[0]}"}}, {{"url": "{CANDIDATES[1]}"}}]}}',
+            "bare urls": f"I would go with {CANDIDATES[0]} and {CANDIDATES[1]}.",
+        }
+        for shape, reply in replies.items():
+            with self.subTest(shape=shape):
+                self.assertEqual(extract_url_list(reply, CANDIDATES, count=2), CANDIDATES[:2])
+
+    def test_drops_urls_outside_the_candidates(self) -> None:
+        from utils.structured import extract_url_list
+
+        reply: str = f'["https://invented.example.com/job", "{CANDIDATES[2]}"]'
+        self.assertEqual(extract_url_list(reply, CANDIDATES, count=2), [CANDIDATES[2]])
+        self.assertIsNone(extract_url_list('["https://invented.example.com/job"]', CANDIDATES, count=2))
+        self.assertIsNone(extract_url_list("", CANDIDATES, count=2))
+
+
+@unittest.skipUnless(importlib.util.find_spec("streamlit"), "streamlit is not installed")
+class ChoiceConstraintTest(unittest.TestCase):
+    def test_only_listed_choices_followed_by_eos_are_allowed(self) -> None:
+        from utils.structured import choice_constraint
+
+        tokenizer: CharacterTokenizer = CharacterTokenizer()
+        prompt: list[int] = tokenizer.encode("prompt")
+        allowed_tokens, longest = choice_constraint(tokenizer, ["ab", "ac"], prompt_length=len(prompt))
+
+        self.assertEqual(longest, 3)
+        self.assertEqual(allowed_tokens(0, TokenIds(prompt)), [ord("a")])
+        self.assertEqual(sorted(allowed_tokens(0, TokenIds(prompt + [ord("a")]))), [ord("b"), ord("c")])
+        self.assertEqual(allowed_tokens(0, TokenIds(prompt + tokenizer.encode("ab"))), [tokenizer.eos_token_id])
+        self.assertEqual(allowed_tokens(0, TokenIds(prompt + tokenizer.encode("ab") + [0])),
+                         [tokenizer.eos_token_id])
+        self.assertEqual(allowed_tokens(0, TokenIds(prompt + tokenizer.encode("x"))), [tokenizer.eos_token_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
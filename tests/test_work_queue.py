@@ -0,0 +1,72 @@
+import threading
+import unittest
+
+from utils.work_queue import WorkQueue
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class WorkQueueTest(unittest.TestCase):
+    def test_resubmit_after_releasing_a_running_job_starts_a_fresh_job(self) -> None:
+        queue: WorkQueue = WorkQueue(slots=1)
+        started: threading.Event = threading.Event()
+        cancel_event: threading.Event = threading.Event()
+
+        def cancellable_job() -> str:
+            started.set()
+            cancel_event.wait(timeout=5)
+            raise PipelineCancelled("Pipeline cancelled")
+
+        first = queue.submit(session="session", key="same inputs", function=cancellable_job,
+                             cancel_event=cancel_event)
+        self.assertTrue(started.wait(timeout=5))
+
+        self.assertTrue(queue.release(first))
+        self.assertTrue(cancel_event.is_set())
+        second = queue.submit(session="session", key="same inputs", function=lambda: "job post")
+
+        self.assertIsNot(first, second)
+        self.assertEqual(second.result(timeout=5), "job post")
+        self.assertRaises(PipelineCancelled, first.result, timeout=5)
+
+    def test_shared_running_job_is_kept_for_the_other_session(self) -> None:
+        queue: WorkQueue = WorkQueue(slots=1)
+        release_job: threading.Event = threading.Event()
+
+        first = queue.submit(session="first", key="same inputs", function=lambda: release_job.wait(timeout=5))
+        second = queue.submit(session="second", key="same inputs", function=lambda: False)
+
+        self.assertIs(first, second)
+        self.assertFalse(queue.release(first))
+        release_job.set()
+        self.assertTrue(second.result(timeout=5))
+
+    def test_shared_job_is_cancelled_when_the_last_session_releases_it(self) -> None:
+        queue: WorkQueue = WorkQueue(slots=1)
+        started: threading.Event = threading.Event()
+        cancel_event: threading.Event = threading.Event()
+
+        def cancellable_job() -> str:
+            started.set()
+            if cancel_event.wait(timeout=5):
+                raise PipelineCancelled("Pipeline cancelled")
+            return "job post"
+
+        first = queue.submit(session="first", key="same inputs", function=cancellable_job, cancel_event=cancel_event)
+        self.assertTrue(started.wait(timeout=5))
+        second = queue.submit(session="second", key="same inputs", function=lambda: "unused",
+                              cancel_event=threading.Event())
+
+        self.assertIs(first, second)
+        self.assertFalse(queue.is_shared(first, "first"))
+        self.assertTrue(queue.is_shared(second, "second"))
+        self.assertFalse(queue.release(first))
+        self.assertFalse(cancel_event.is_set())
+        self.assertTrue(queue.release(second))
+        self.assertRaises(PipelineCancelled, second.result, timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
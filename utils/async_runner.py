@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.progress import PipelineProgress
+
+CANCEL_POLL_SECONDS: float = 0.1
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class StageTimeout(Exception):
+    pass
+
+
+def raise_if_cancelled(cancel_event: Optional[threading.Event]) -> None:
+    """
+    This helper function is used by long blocking stages to stop between steps once the run is cancelled,
+    cancelling the asyncio task alone leaves the worker thread running
+    :param cancel_event: optional cancel event of the run
+    :return: None
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled("Pipeline cancelled")
+
+
+# ------------------coroutine wrappers------------------ #
+def as_coroutine(function: Callable[..., Any], executor: Optional[Executor] = None) -> Callable[..., Awaitable[Any]]:
+    """
+    This helper function is used to expose a blocking pipeline function as a coroutine,
+    the call runs in a worker thread with the caller's context variables
+    :param function: blocking function
+    :param executor: optional executor, defaults to the event loop executor
+    :return: coroutine function with the same arguments
+    """
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        call: Callable[[], Any] = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+        return await loop.run_in_executor(executor, call)
+
+    return wrapper
+
+
+# ------------------stage dependency graph------------------ #
+@dataclass
+class GraphStage:
+    name: str
+    function: Callable[[dict], Awaitable[Any]]
+    deps: tuple
+    timeout: Optional[float] = None
+    progress_key: Optional[str] = None
+
+
+class StageGraph:
+    """
+    This class is used to run pipeline stages as a dependency graph, every stage whose dependencies are
+    done runs at the same time. Stages sharing a progress key are reported as one progress step
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, progress: Optional[PipelineProgress] = None,
+                 cancel_event: Optional[threading.Event] = None) -> None:
+        self.executor: Optional[Executor] = executor
+        self.progress: Optional[PipelineProgress] = progress
+        self.cancel_event: threading.Event = cancel_event or threading.Event()
+        self.stages: dict[str, GraphStage] = {}
+
+    def add(self, name: str, function: Callable[[dict], Awaitable[Any]], deps: tuple = (),
+            timeout: Optional[float] = None, progress_key: Optional[str] = None) -> None:
+        """
+        This function is used to add a stage to the graph
+        :param name: stage name
+        :param function: coroutine function receiving the results of the finished stages
+        :param deps: names of the stages that have to finish first
+        :param timeout: optional stage timeout in seconds
+        :param progress_key: optional key of the stage in the progress map
+        :return: None
+        """
+        self.stages[name] = GraphStage(name=name, function=function, deps=tuple(deps), timeout=timeout,
+                                       progress_key=progress_key)
+
+    async def call(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        This function is used to run a blocking function on the graph executor
+        :param function: blocking function
+        :return: function result
+        """
+        return await as_coroutine(function, self.executor)(*args, **kwargs)
+
+    def _progress_remaining(self) -> dict[str, int]:
+        remaining: dict[str, int] = {}
+        for stage in self.stages.values():
+            if stage.progress_key:
+                remaining[stage.progress_key] = remaining.get(stage.progress_key, 0) + 1
+        return remaining
+
+    async def _run_stage(self, stage: GraphStage, results: dict) -> Any:
+        try:
+            return await asyncio.wait_for(stage.function(results), timeout=stage.timeout)
+        except asyncio.TimeoutError:
+            raise StageTimeout(f"{stage.name} timed out after {stage.timeout}s")
+
+    async def run(self) -> dict:
+        """
+        This function is used to run the graph until every stage is done, the first failure, a timeout
+        or a cancellation stops the remaining stages. The cancel event is set on the way out, so blocking
+        stages still running in worker threads stop at their next check
+        :return: dict of stage results
+        """
+        results: dict = {}
+        pending: dict[str, GraphStage] = dict(self.stages)
+        running: dict[asyncio.Task, GraphStage] = {}
+        remaining: dict[str, int] = self._progress_remaining()
+        started_keys: set[str] = set()
+
+        try:
+            while pending or running:
+                if self.cancel_event.is_set():
+                    raise PipelineCancelled("Pipeline cancelled")
+
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        del pending[name]
+                        if stage.progress_key and stage.progress_key not in started_keys and self.progress:
+                            started_keys.add(stage.progress_key)
+                            self.progress.start(stage.progress_key)
+                        running[asyncio.create_task(self._run_stage(stage, results))] = stage
+
+                if not running:
+                    raise ValueError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+
+                done, _ = await asyncio.wait(running, timeout=CANCEL_POLL_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage: GraphStage = running.pop(task)
+                    try:
+                        results[stage.name] = task.result()
+                    except Exception as error:
+                        if stage.progress_key and self.progress:
+                            self.progress.finish(stage.progress_key, error=error)
+                        raise
+                    if stage.progress_key:
+                        remaining[stage.progress_key] -= 1
+                        if not remaining[stage.progress_key] and self.progress:
+                            self.progress.finish(stage.progress_key)
+        except BaseException:
+            self.cancel_event.set()
+            raise
+        finally:
+            for task in running:
+                task.cancel()
+
+        return results
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from utils.telemetry import record_cache
+
+CACHE_DIR: str = os.getenv("JOB_ROLE_CACHE_DIR", ".cache")
+
+_MISSING: Any = object()
+
+
+# ------------------in-memory cache------------------ #
+class MemoryCache:
+    """
+    This class is used to keep recent values in memory, bounded by entry count and expired by TTL
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None) -> None:
+        self.max_entries: int = max_entries
+        self.ttl: Optional[float] = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry: Any = self._entries.get(key)
+            if entry is None:
+                return default
+            stored_at, value = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ------------------on-disk cache------------------ #
+class DiskCache:
+    """
+    This class is used to persist values as pickle files in a directory, bounded by entry count and expired by TTL.
+    The least recently written files are removed first
+    """
+
+    def __init__(self, directory: str, max_entries: int = 1024, ttl: Optional[float] = None) -> None:
+        self.directory: Path = Path(directory)
+        self.max_entries: int = max_entries
+        self.ttl: Optional[float] = ttl
+        self._lock: threading.Lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode()).hexdigest()}.pkl"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path: Path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return default
+            with path.open("rb") as file:
+                stored_key, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        return value if stored_key == key else default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path: Path = self._path(key)
+            temporary_path: Path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with temporary_path.open("wb") as file:
+                pickle.dump((key, value), file)
+            # atomic replace so concurrent readers never see a partial file
+            os.replace(temporary_path, path)
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self.directory.glob("*.pkl"):
+                path.unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        files: list[Path] = list(self.directory.glob("*.pkl"))
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda file: file.stat().st_mtime)
+        for path in files[:len(files) - self.max_entries]:
+            path.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return len(list(self.directory.glob("*.pkl"))) if self.directory.exists() else 0
+
+
+# ------------------memory in front of disk------------------ #
+class TieredCache:
+    """
+    This class is used to look values up in each backend in turn, promoting disk hits into memory
+    """
+
+    def __init__(self, *backends: Any) -> None:
+        self.backends: tuple = backends
+
+    def get(self, key: str, default: Any = None) -> Any:
+        for index, backend in enumerate(self.backends):
+            value: Any = backend.get(key, _MISSING)
+            if value is not _MISSING:
+                for faster_backend in self.backends[:index]:
+                    faster_backend.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        for backend in self.backends:
+            backend.set(key, value)
+
+    def delete(self, key: str) -> None:
+        for backend in self.backends:
+            backend.delete(key)
+
+    def clear(self) -> None:
+        for backend in self.backends:
+            backend.clear()
+
+
+# ------------------request coalescing------------------ #
+class SingleFlight:
+    """
+    This class is used to coalesce concurrent calls for the same key, so only one of them does the work
+    and the others wait for its result
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: dict[str, Future] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        """
+        This function is used to run the function once for all concurrent callers of the key
+        :param key: call key
+        :param function: callable doing the work
+        :return: function result
+        """
+        with self._lock:
+            future: Optional[Future] = self._in_flight.get(key)
+            leader: bool = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result: Any = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+def cached_call(cache: Any, flight: SingleFlight, key: str, function: Callable[[], Any],
+                cache_if: Callable[[Any], bool] = lambda value: True, name: Optional[str] = None) -> Any:
+    """
+    This helper function is used to return the cached value of the key, computing it once on a miss
+    :param cache: cache backend
+    :param flight: request coalescer
+    :param key: cache key
+    :param function: callable computing the value
+    :param cache_if: predicate deciding whether a computed value is stored
+    :param name: optional cache name, lookups are recorded in the metrics when given
+    :return: cached or computed value
+    """
+    value: Any = cache.get(key, _MISSING)
+    if name is not None:
+        record_cache(name, hit=value is not _MISSING)
+    if value is not _MISSING:
+        return value
+
+    def compute() -> Any:
+        # another caller may have filled the cache while this one waited for the lock
+        cached: Any = cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        result: Any = function()
+        if cache_if(result):
+            cache.set(key, result)
+        return result
+
+    return flight.do(key, compute)
+
+
+# ------------------content-addressed stage cache------------------ #
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in sorted(value.items(), key=lambda pair: str(pair[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if hasattr(value, "page_content"):
+        return {"page_content": value.page_content, "metadata": _canonical(getattr(value, "metadata", {}))}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def content_hash(*parts: Any) -> str:
+    """
+    This helper function is used to hash values by content, so equal inputs always give the same key
+    :param parts: values to hash
+    :return: hex digest
+    """
+    encoded: bytes = json.dumps(_canonical(list(parts)), sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StageCache:
+    """
+    This class is used to memoise pipeline stage outputs by a hash of the stage inputs and model settings,
+    so a rerun only recomputes the stages whose inputs changed
+    """
+
+    def __init__(self, backend: Any) -> None:
+        self.backend: Any = backend
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._flight: SingleFlight = SingleFlight()
+
+    def key(self, stage: str, inputs: dict, params: Optional[dict] = None) -> str:
+        return f"{stage}:{content_hash(inputs, params or {})}"
+
+    def memoise(self, stage: str, function: Callable[..., Any], params: Optional[dict] = None,
+                cache_if: Callable[[Any], bool] = lambda value: True, **inputs: Any) -> Any:
+        """
+        This function is used to return the cached output of a stage, running it on a miss
+        :param stage: stage name
+        :param function: stage function, called with the inputs and params as keyword arguments
+        :param params: settings that change the output without being data inputs (model, temperature)
+        :param cache_if: predicate deciding whether an output is stored, e.g. to skip the empty output of a failure
+        :param inputs: stage inputs
+        :return: stage output
+        """
+        key: str = self.key(stage, inputs, params)
+        value: Any = self.backend.get(key, _MISSING)
+        record_cache(f"stage:{stage}", hit=value is not _MISSING)
+        if value is not _MISSING:
+            self.hits[stage] += 1
+            return value
+
+        self.misses[stage] += 1
+        return cached_call(self.backend, self._flight, key, lambda: function(**inputs, **(params or {})),
+                           cache_if=cache_if)
+
+    def stats(self) -> dict:
+        """
+        This function is used to report the hit and miss counters of every stage
+        :return: dict of stage counters
+        """
+        return {stage: {"hits": self.hits[stage], "misses": self.misses[stage]}
+                for stage in sorted(set(self.hits) | set(self.misses))}
+
+
+def build_cache_backend(kind: str, name: str, max_entries: int, ttl: Optional[float]) -> Any:
+    """
+    This helper function is used to build a memory, disk or tiered (memory in front of disk) cache backend
+    :param kind: memory, disk or tiered
+    :param name: sub directory of the disk cache
+    :param max_entries: max number of entries per backend
+    :param ttl: time to live in seconds
+    :return: cache backend
+    """
+    if kind == "memory":
+        return MemoryCache(max_entries=max_entries, ttl=ttl)
+    disk: DiskCache = DiskCache(directory=os.path.join(CACHE_DIR, name), max_entries=max_entries, ttl=ttl)
+    if kind == "disk":
+        return disk
+    if kind == "tiered":
+        return TieredCache(MemoryCache(max_entries=max_entries, ttl=ttl), disk)
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+def normalise_query(query: str) -> str:
+    """
+    This helper function is used to normalise a search query so equivalent queries share a cache key
+    :param query: search query
+    :return: normalised query
+    """
+    return " ".join(query.lower().split())
+
+
+# ------------------shared caches, kept at module level so they survive streamlit reruns------------------ #
+SERPER_CACHE_TTL: float = float(os.getenv("SERPER_CACHE_TTL", str(6 * 60 * 60)))
+
+serper_cache: TieredCache = TieredCache(
+    MemoryCache(max_entries=256, ttl=SERPER_CACHE_TTL),
+    DiskCache(directory=os.path.join(CACHE_DIR, "serper"), max_entries=2048, ttl=SERPER_CACHE_TTL)
+)
+serper_flight: SingleFlight = SingleFlight()
+
+PAGE_CACHE_TTL: float = float(os.getenv("PAGE_CACHE_TTL", str(6 * 60 * 60)))
+
+page_cache: TieredCache = TieredCache(
+    MemoryCache(max_entries=128, ttl=PAGE_CACHE_TTL),
+    DiskCache(directory=os.path.join(CACHE_DIR, "pages"), max_entries=4096, ttl=PAGE_CACHE_TTL)
+)
+page_flight: SingleFlight = SingleFlight()
+
+LINKEDIN_PROFILE_CACHE_TTL: float = float(os.getenv("LINKEDIN_PROFILE_CACHE_TTL", str(24 * 60 * 60)))
+
+linkedin_profile_cache: TieredCache = TieredCache(
+    MemoryCache(max_entries=1024, ttl=LINKEDIN_PROFILE_CACHE_TTL),
+    DiskCache(directory=os.path.join(CACHE_DIR, "linkedin"), max_entries=8192, ttl=LINKEDIN_PROFILE_CACHE_TTL)
+)
+linkedin_profile_flight: SingleFlight = SingleFlight()
+
+STAGE_CACHE_TTL: float = float(os.getenv("STAGE_CACHE_TTL", str(24 * 60 * 60)))
+
+stage_cache: StageCache = StageCache(backend=build_cache_backend(
+    kind=os.getenv("STAGE_CACHE_BACKEND", "tiered"), name="stages",
+    max_entries=int(os.getenv("STAGE_CACHE_MAX_ENTRIES", "512")), ttl=STAGE_CACHE_TTL
+))
@@ -0,0 +1,197 @@
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# ------------------boilerplate patterns------------------ #
+boilerplate_patterns: list[str] = [
+    r"\bcookies?\b", r"accept all", r"privacy (policy|notice|settings)", r"terms (of use|and conditions|& conditions)",
+    r"all rights reserved", r"©", r"\bsign (in|up)\b", r"\blog ?in\b", r"\bsubscribe\b", r"newsletter",
+    r"skip to (main )?content", r"follow us", r"share (on|this)", r"enable javascript", r"back to top",
+    r"download (our|the) app", r"job alert",
+]
+_boilerplate_regex: re.Pattern = re.compile("|".join(boilerplate_patterns), flags=re.IGNORECASE)
+
+BOILERPLATE_MAX_LINE_LENGTH: int = 160
+NEAR_DUPLICATE_THRESHOLD: float = 0.8
+SHINGLE_SIZE: int = 5
+NUM_PERMUTATIONS: int = 64
+
+_MERSENNE_PRIME: int = (1 << 61) - 1
+_permutations: list[tuple[int, int]] = [
+    (int.from_bytes(blake2b(f"a{seed}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME or 1,
+     int.from_bytes(blake2b(f"b{seed}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for seed in range(NUM_PERMUTATIONS)
+]
+
+
+# ------------------chunking report------------------ #
+@dataclass
+class ChunkingReport:
+    input_chunks: int = 0
+    output_chunks: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    duplicate_chunks: int = 0
+
+    @property
+    def chunks_saved(self) -> int:
+        return self.input_chunks - self.output_chunks
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.input_tokens - self.output_tokens
+
+
+# ------------------boilerplate stripping------------------ #
+def _is_boilerplate(line: str, repeated_lines: set[str]) -> bool:
+    # long repeated lines are real content, near duplicate chunks catch those. A short line on its own is not
+    # navigation: skill bullets, headings and job titles are short too
+    return len(line) <= BOILERPLATE_MAX_LINE_LENGTH and bool(line in repeated_lines or _boilerplate_regex.search(line))
+
+
+def repeated_lines_across(texts: list[str]) -> set[str]:
+    """
+    This helper function is used to find lines that appear on several pages or several times on a page,
+    which is how headers and footers look
+    :param texts: page texts
+    :return: set of repeated lines
+    """
+    page_counts: Counter = Counter()
+    line_counts: Counter = Counter()
+    for text in texts:
+        lines: list[str] = [line.strip() for line in text.splitlines() if line.strip()]
+        line_counts.update(lines)
+        page_counts.update(set(lines))
+    return ({line for line, count in page_counts.items() if count > 1}
+            | {line for line, count in line_counts.items() if count > 2})
+
+
+def strip_boilerplate(text: str, repeated_lines: Optional[set[str]] = None) -> str:
+    """
+    This function is used to drop navigation, cookie banners, footers and other lines that carry no job content
+    :param text: page text
+    :param repeated_lines: lines repeated across pages
+    :return: cleaned text
+    """
+    repeated_lines = repeated_lines or set()
+    paragraphs: list[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines: list[str] = [line.strip() for line in paragraph.splitlines()
+                            if line.strip() and not _is_boilerplate(line.strip(), repeated_lines)]
+        if lines:
+            paragraphs.append("\n".join(lines))
+    return "\n\n".join(paragraphs)
+
+
+# ------------------token based splitting------------------ #
+def split_by_tokens(text: str, max_tokens: int, count: Callable[[str], int]) -> list[str]:
+    """
+    This function is used to pack paragraphs into chunks of at most max_tokens, long paragraphs are split
+    at sentence boundaries so chunks never cut a sentence in half
+    :param text: cleaned text
+    :param max_tokens: max number of tokens per chunk
+    :param count: token counter
+    :return: list of chunks
+    """
+    units: list[tuple[str, int]] = []
+    for paragraph in text.split("\n\n"):
+        if not paragraph.strip():
+            continue
+        paragraph_tokens: int = count(paragraph)
+        if paragraph_tokens <= max_tokens:
+            units.append((paragraph, paragraph_tokens))
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            # a single sentence longer than a chunk is still kept whole
+            units.append((sentence, count(sentence)))
+
+    chunks: list[str] = []
+    current: list[str] = []
+    current_tokens: int = 0
+    for unit, unit_tokens in units:
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+# ------------------near-duplicate detection------------------ #
+def minhash_signature(text: str) -> tuple[int, ...]:
+    """
+    This function is used to compute the MinHash signature of the word shingles of a text
+    :param text: chunk text
+    :return: signature
+    """
+    words: list[str] = re.findall(r"\w+", text.lower())
+    shingles: set[str] = {" ".join(words[index:index + SHINGLE_SIZE])
+                          for index in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    hashes: list[int] = [int.from_bytes(blake2b(shingle.encode(), digest_size=8).digest(), "big")
+                         for shingle in shingles]
+    return tuple(min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _permutations)
+
+
+def estimated_similarity(first: tuple[int, ...], second: tuple[int, ...]) -> float:
+    """
+    This function is used to estimate the Jaccard similarity of two texts from their signatures
+    :param first: signature
+    :param second: signature
+    :return: similarity between 0 and 1
+    """
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERMUTATIONS
+
+
+# ------------------chunk preparation------------------ #
+def prepare_chunks(documents: list, max_tokens: int, count: Callable[[str], int],
+                   seen_documents: Optional[list] = None) -> tuple[list, ChunkingReport]:
+    """
+    This function is used to turn fetched pages into the fewest, densest chunks worth summarising:
+    boilerplate is stripped, text is split by token count at paragraph and sentence boundaries, and
+    chunks that are near duplicates of another chunk (or of a page in seen_documents) are dropped
+    :param documents: fetched page documents
+    :param max_tokens: max number of tokens per chunk
+    :param count: token counter
+    :param seen_documents: pages summarised elsewhere, their chunks are only used for duplicate detection
+    :return: (list of chunk documents, chunking report)
+    """
+    from langchain.schema import Document
+
+    seen_documents = seen_documents or []
+    report: ChunkingReport = ChunkingReport()
+    repeated_lines: set[str] = repeated_lines_across([document.page_content for document in documents + seen_documents])
+
+    signatures: list[tuple[int, ...]] = [
+        minhash_signature(chunk)
+        for document in seen_documents
+        for chunk in split_by_tokens(strip_boilerplate(document.page_content, repeated_lines), max_tokens, count)
+    ]
+
+    chunks: list = []
+    for document in documents:
+        raw_tokens: int = count(document.page_content)
+        report.input_tokens += raw_tokens
+        report.input_chunks += max(-(-raw_tokens // max_tokens), 1)
+
+        for chunk in split_by_tokens(strip_boilerplate(document.page_content, repeated_lines), max_tokens, count):
+            if not chunk.strip():
+                continue
+            signature: tuple[int, ...] = minhash_signature(chunk)
+            if any(estimated_similarity(signature, seen) >= NEAR_DUPLICATE_THRESHOLD for seen in signatures):
+                report.duplicate_chunks += 1
+                continue
+            signatures.append(signature)
+            chunks.append(Document(page_content=chunk, metadata=dict(document.metadata)))
+            report.output_tokens += count(chunk)
+
+    report.output_chunks = len(chunks)
+    logger.info("Chunking saved %d chunks and %d tokens (%d near duplicates dropped)",
+                report.chunks_saved, report.tokens_saved, report.duplicate_chunks)
+    return chunks, report
@@ -0,0 +1,122 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+
+
+# ------------------per-backend limits------------------ #
+backend_limits: dict = {
+    "openai": {
+        "concurrency": int(os.getenv("OPENAI_MAX_CONCURRENCY", "4")),
+        "requests_per_minute": int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500")),
+    },
+    "huggingface": {
+        "concurrency": 1,
+        "requests_per_minute": 0,
+        "batch_size": int(os.getenv("HUGGINGFACE_BATCH_SIZE", "4")),
+    },
+    "linkedin": {
+        "concurrency": int(os.getenv("LINKEDIN_MAX_CONCURRENCY", "2")),
+        "requests_per_minute": int(os.getenv("LINKEDIN_REQUESTS_PER_MINUTE", "30")),
+    },
+    "serper": {
+        "concurrency": int(os.getenv("SERPER_MAX_CONCURRENCY", "4")),
+        "requests_per_minute": int(os.getenv("SERPER_REQUESTS_PER_MINUTE", "300")),
+    },
+    "fetch": {
+        "concurrency": int(os.getenv("FETCH_MAX_CONCURRENCY", "16")),
+        "requests_per_minute": 0,
+    },
+}
+
+
+# ------------------rate limiter------------------ #
+class RateLimiter:
+    """
+    This class is used to space out calls so a backend never receives more than the allowed requests per minute
+    """
+
+    def __init__(self, requests_per_minute: int) -> None:
+        self.interval: float = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now: float = time.monotonic()
+            wait: float = max(self._next_slot - now, 0.0)
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait:
+            time.sleep(wait)
+
+
+class BackendGate:
+    """
+    This class is used to cap both the concurrent calls and the call rate of a backend, shared by all sessions
+    """
+
+    def __init__(self, concurrency: int, requests_per_minute: int = 0) -> None:
+        self.concurrency: int = concurrency
+        self._semaphore: threading.BoundedSemaphore = threading.BoundedSemaphore(concurrency)
+        self._rate_limiter: RateLimiter = RateLimiter(requests_per_minute)
+
+    def __enter__(self) -> "BackendGate":
+        self._semaphore.acquire()
+        self._rate_limiter.acquire()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._semaphore.release()
+
+
+_backend_gates: dict[str, BackendGate] = {}
+_backend_gates_lock: threading.Lock = threading.Lock()
+
+
+def backend_gate(backend: str) -> BackendGate:
+    """
+    This helper function is used to return the process-wide gate of a backend
+    :param backend: backend name, a key of backend_limits
+    :return: backend gate
+    """
+    with _backend_gates_lock:
+        if backend not in _backend_gates:
+            limits: dict = backend_limits.get(backend, {"concurrency": 1})
+            _backend_gates[backend] = BackendGate(concurrency=limits["concurrency"],
+                                                  requests_per_minute=limits.get("requests_per_minute", 0))
+        return _backend_gates[backend]
+
+
+# ------------------ordered concurrent map------------------ #
+def ordered_map(function: Callable[[Any], Any], items: Iterable[Any], max_workers: int,
+                gate: Optional[BackendGate] = None) -> list:
+    """
+    This helper function is used to run a function over the items on a bounded worker pool,
+    results are returned in the order of the items and every call sees the caller's context variables
+    :param function: function applied to each item
+    :param items: inputs
+    :param max_workers: size of the worker pool
+    :param gate: optional backend gate every call has to pass
+    :return: list of results
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item: Any) -> Any:
+        if gate is None:
+            return function(item)
+        with gate:
+            return function(item)
+
+    if len(items) == 1 or max_workers <= 1:
+        return [call(item) for item in items]
+
+    # each item gets its own copy, a context can't be entered by two threads at once
+    contexts: list[contextvars.Context] = [contextvars.copy_context() for _ in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda context, item: context.run(call, item), contexts, items))
@@ -0,0 +1,160 @@
+import contextvars
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.concurrency import backend_gate
+from utils.telemetry import external_call
+
+logger = logging.getLogger(__name__)
+
+# ------------------fetch settings------------------ #
+FETCH_TIMEOUT: float = float(os.getenv("FETCH_TIMEOUT", "10"))
+FETCH_RETRIES: int = int(os.getenv("FETCH_RETRIES", "2"))
+FETCH_BACKOFF: float = float(os.getenv("FETCH_BACKOFF", "0.5"))
+FETCH_MAX_WORKERS: int = int(os.getenv("FETCH_MAX_WORKERS", "8"))
+FETCH_PER_HOST: int = int(os.getenv("FETCH_PER_HOST", "2"))
+PARSER_WORKERS: int = int(os.getenv("PARSER_WORKERS", "2"))
+
+RETRYABLE_STATUS_CODES: tuple = (429, 500, 502, 503, 504)
+
+# transport signature: (url, timeout) -> html
+Transport = Callable[[str, float], str]
+
+
+# ------------------shared keep-alive session------------------ #
+@lru_cache(maxsize=1)
+def http_session() -> requests.Session:
+    """
+    This helper function is used to build the process-wide session, so connections are pooled and kept alive
+    :return: requests session
+    """
+    session: requests.Session = requests.Session()
+    adapter: HTTPAdapter = HTTPAdapter(pool_connections=FETCH_MAX_WORKERS, pool_maxsize=FETCH_MAX_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": "Mozilla/5.0 (compatible; job-role-generator)"})
+    return session
+
+
+class RetryableStatusError(requests.HTTPError):
+    pass
+
+
+def session_transport(url: str, timeout: float) -> str:
+    """
+    This function is the default transport, it downloads the page through the shared session
+    :param url: page url
+    :param timeout: request timeout in seconds
+    :return: page html
+    """
+    response: requests.Response = http_session().get(url, timeout=timeout)
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        raise RetryableStatusError(f"{response.status_code} for {url}", response=response)
+    response.raise_for_status()
+    return response.text
+
+
+# ------------------per-host concurrency------------------ #
+_host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock: threading.Lock = threading.Lock()
+
+
+def _host_semaphore(url: str) -> threading.BoundedSemaphore:
+    host: str = urlparse(url).netloc
+    with _host_semaphores_lock:
+        return _host_semaphores.setdefault(host, threading.BoundedSemaphore(FETCH_PER_HOST))
+
+
+def fetch_with_retry(url: str, transport: Transport, timeout: float = FETCH_TIMEOUT,
+                     retries: int = FETCH_RETRIES, backoff: float = FETCH_BACKOFF) -> str:
+    """
+    This function is used to download a page, retrying timeouts, connection errors and retryable statuses
+    with exponential backoff
+    :param url: page url
+    :param transport: callable used to download the page
+    :param timeout: request timeout in seconds
+    :param retries: number of retries after the first attempt
+    :param backoff: base backoff in seconds
+    :return: page html
+    """
+    for attempt in range(retries + 1):
+        try:
+            with backend_gate("fetch"), _host_semaphore(url):
+                return transport(url, timeout)
+        except (requests.Timeout, requests.ConnectionError, RetryableStatusError, TimeoutError, ConnectionError):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+# ------------------html parsing------------------ #
+def extract_text(html: str) -> str:
+    """
+    This function is used to turn a html page into plain text, it runs in the parser process pool
+    :param html: page html
+    :return: extracted text
+    """
+    from unstructured.partition.html import partition_html
+
+    elements: list = partition_html(text=html)
+    return "\n\n".join(str(element) for element in elements)
+
+
+@lru_cache(maxsize=1)
+def parser_pool() -> ProcessPoolExecutor:
+    """
+    This helper function is used to create the process pool used for html parsing. The workers are spawned,
+    forking the threaded app process (tornado, torch threads, the sqlite handle) can deadlock the child
+    :return: process pool
+    """
+    return ProcessPoolExecutor(max_workers=PARSER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+# ------------------concurrent page fetching------------------ #
+def fetch_documents(urls: list, transport: Optional[Transport] = None, parse_in_process: bool = True,
+                    timeout: float = FETCH_TIMEOUT) -> list:
+    """
+    This function is used to download the urls concurrently and parse them off the calling thread.
+    Pages that fail after all retries are skipped, the remaining documents keep the url order
+    :param urls: page urls
+    :param transport: callable used to download the pages, defaults to the shared session
+    :param parse_in_process: parse html in the process pool, otherwise in the fetch thread
+    :param timeout: request timeout in seconds
+    :return: list of documents
+    """
+    from langchain.schema import Document
+
+    transport = transport or session_transport
+    if not urls:
+        return []
+
+    def fetch_and_parse(url: str) -> Optional[Document]:
+        try:
+            with external_call("job_site"):
+                html: str = fetch_with_retry(url, transport=transport, timeout=timeout)
+            if parse_in_process:
+                parsed: Future = parser_pool().submit(extract_text, html)
+                text: str = parsed.result()
+            else:
+                text: str = extract_text(html)
+        except Exception as error:
+            logger.warning("Skipping %s: %s", url, error)
+            return None
+        return Document(page_content=text, metadata={"source": url})
+
+    contexts: list[contextvars.Context] = [contextvars.copy_context() for _ in urls]
+    with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(urls))) as executor:
+        documents: list[Any] = list(executor.map(lambda context, url: context.run(fetch_and_parse, url),
+                                                 contexts, urls))
+
+    return [document for document in documents if document is not None]
@@ -1,36 +1,223 @@
+import logging
 import os
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Optional
 
 import streamlit as st
-from huggingface_hub import login
-from langchain.chat_models import ChatOpenAI
-from transformers import pipeline
+from streamlit.runtime.scriptrunner import SCRIPT_RUN_CONTEXT_ATTR_NAME, add_script_run_ctx, get_script_run_ctx
 
-HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")
+from utils.concurrency import backend_limits
+from utils.progress import StageEvent
+from utils.registry import model_registry
+from utils.telemetry import traced
 
-# ---------huggingface login--------- #
-login(token=HUGGINGFACE_API_TOKEN)
+logger = logging.getLogger(__name__)
 
+# ---------local model settings--------- #
+LOCAL_MODEL_BACKEND: str = os.getenv("LOCAL_MODEL_BACKEND", "cpu")
+LOCAL_MODEL_QUANTISATION: str = os.getenv("LOCAL_MODEL_QUANTISATION", "int8")
+LOCAL_MODEL_THREADS: Optional[int] = int(os.getenv("LOCAL_MODEL_THREADS", "0")) or None
+DEFAULT_MAX_NEW_TOKENS: int = 256
 
-def model_validator(model: Any, temperature: Any) -> Any:
+
+# ---------huggingface login, the model backends are imported on first use to keep the app start fast--------- #
+@lru_cache(maxsize=1)
+def huggingface_login() -> None:
+    """
+    This helper function is used to log in to huggingface once per process, on first use of a local model
+    :return: None
+    """
+    from huggingface_hub import login
+
+    login(token=os.getenv("HUGGINGFACE_API_TOKEN"))
+
+
+# ---------linkedin client--------- #
+@lru_cache(maxsize=1)
+def get_linkedin_client() -> Any:
+    """
+    This helper function is used to authenticate the LinkedIn client once per process, on the first profile lookup
+    :return: LinkedIn client
+    """
+    from linkedin_api import Linkedin
+
+    return Linkedin(os.getenv("LINKEDIN_USERNAME"), os.getenv("LINKEDIN_PASSWORD"))
+
+
+# ------------------model registry------------------ #
+def _pipeline_footprint(text_pipeline: Any) -> int:
+    """
+    This helper function is used to measure the size of the loaded model weights
+    :param text_pipeline: huggingface pipeline
+    :return: parameter memory in bytes
+    """
+    return sum(param.numel() * param.element_size() for param in text_pipeline.model.parameters())
+
+
+def _load_huggingface_engine(model: Any, temperature: Any, max_tokens: Optional[int], device: Any) -> Any:
+    """
+    This helper function is used to wrap the shared huggingface weights with the requested generation settings.
+    On CPU the tuned local engine is used unless LOCAL_MODEL_BACKEND is set to pipeline
+    :param model: generative model
+    :param temperature: randomness of model output
+    :param max_tokens: max number of generated tokens
+    :param device: device the weights are loaded on
+    :return: langchain llm
+    """
+    from utils.local_llm import CPUCausalLMEngine, CPUEngineLLM, LocalPipelineLLM
+
+    if device in (None, "cpu") and LOCAL_MODEL_BACKEND == "cpu":
+        def load_engine() -> CPUCausalLMEngine:
+            huggingface_login()
+            return CPUCausalLMEngine(model_id=model, quantisation=LOCAL_MODEL_QUANTISATION, threads=LOCAL_MODEL_THREADS)
+
+        engine: CPUCausalLMEngine = model_registry.get(
+            key=(model, None, None, device), loader=load_engine, footprint=lambda loaded: loaded.footprint())
+
+        return CPUEngineLLM(engine=engine, temperature=temperature, max_new_tokens=max_tokens or DEFAULT_MAX_NEW_TOKENS,
+                            batch_size=backend_limits["huggingface"]["batch_size"])
+
+    def load_weights() -> Any:
+        from transformers import pipeline
+
+        huggingface_login()
+        text_pipeline: Any = pipeline("text-generation", model=model, device=device)
+        if text_pipeline.tokenizer.pad_token_id is None:
+            # batched generation needs a pad token, llama doesn't define one
+            text_pipeline.tokenizer.pad_token_id = text_pipeline.model.config.eos_token_id
+        return text_pipeline
+
+    text_pipeline: Any = model_registry.get(
+        key=(model, None, None, device), loader=load_weights, footprint=_pipeline_footprint)
+
+    generation_kwargs: dict = {"do_sample": temperature > 0}
+    if temperature > 0:
+        generation_kwargs["temperature"] = temperature
+    if max_tokens:
+        generation_kwargs["max_new_tokens"] = max_tokens
+
+    return LocalPipelineLLM(pipeline=text_pipeline, generation_kwargs=generation_kwargs,
+                            batch_size=backend_limits["huggingface"]["batch_size"])
+
+
+def model_backend(model: Any) -> str:
+    """
+    This helper function is used to identify which backend serves the model
+    :param model: generative model
+    :return: backend name (openai or huggingface)
+    """
+    return "openai" if model == "gpt-3.5-turbo" else "huggingface"
+
+
+# loaders of models that are served neither by OpenAI nor from the hub, such as the benchmark stand-in model,
+# called with the temperature and max_tokens of the engine
+model_loaders: dict[str, Callable[..., Any]] = {}
+
+
+@traced("model_validator")
+def model_validator(model: Any, temperature: Any, max_tokens: Optional[int] = None, device: Any = None) -> Any:
     """
     This helper function is used to generate the correct syntax for the models,
-    depending on whether they are from huggingface or openai
+    depending on whether they are from huggingface or openai. Engines are loaded once and
+    shared through the model registry
     :param model: generative model
     :param temperature: randomness of model output
+    :param max_tokens: max number of generated tokens
+    :param device: device for local models
     :return: model call logic
     """
-    if model == "gpt-3.5-turbo":
-        model_call: Any = ChatOpenAI(model_name=model, temperature=temperature)
+    temperature = round(float(temperature), 2)
+    key: tuple = (model, temperature, max_tokens, device)
+
+    if model in model_loaders:
+        model_call: Any = model_registry.get(
+            key=key, loader=lambda: model_loaders[model](temperature=temperature, max_tokens=max_tokens),
+            lightweight=True)
+    elif model_backend(model) == "openai":
+        def load_chat_model() -> Any:
+            from langchain.chat_models import ChatOpenAI
+
+            return ChatOpenAI(model_name=model, temperature=temperature, max_tokens=max_tokens)
+
+        model_call: Any = model_registry.get(key=key, loader=load_chat_model, lightweight=True)
     else:
-        login(token=HUGGINGFACE_API_TOKEN)
-        model_call: Any = pipeline("text-generation", model=model)
+        model_call: Any = model_registry.get(
+            key=key, loader=lambda: _load_huggingface_engine(model, temperature, max_tokens, device), lightweight=True)
 
     return model_call
 
 
+def stream_tokens(llm: Any, prompt: str) -> Iterator[str]:
+    """
+    This helper function is used to stream the completion of an engine returned by model_validator
+    :param llm: model engine
+    :param prompt: formatted prompt
+    :return: iterator of text pieces
+    """
+    from utils.local_llm import CPUEngineLLM, LocalPipelineLLM
+
+    if isinstance(llm, (LocalPipelineLLM, CPUEngineLLM)):
+        yield from llm.stream_text(prompt)
+    else:
+        for chunk in llm.stream(prompt):
+            yield getattr(chunk, "content", chunk)
+
+
+def register_prompt_prefix(llm: Any, prompt_template: str) -> None:
+    """
+    This helper function is used to let a local engine precompute the key/value cache of the fixed start
+    of a prompt template, engines without a prefix cache are left alone
+    :param llm: model engine
+    :param prompt_template: prompt template
+    :return: None
+    """
+    from utils.local_llm import CPUEngineLLM
+
+    prefix: str = prompt_template.split("{", 1)[0]
+    if isinstance(llm, CPUEngineLLM) and prefix.strip():
+        llm.register_prefix(prefix)
+
+
+def warm_up_models(model_names: list[str], temperature: float = 0.5) -> None:
+    """
+    This helper function is used to load the listed models before the first request
+    :param model_names: models to load
+    :param temperature: temperature of the warmed engines
+    :return: None
+    """
+    from utils.prompting import completion_token_limit
+
+    for model in model_names:
+        # the default completion limit is the one the stages use with the default sidebar setting
+        model_validator(model=model, temperature=temperature, max_tokens=completion_token_limit(model))
+
+
+@lru_cache(maxsize=1)
+def start_model_warm_up(model_names: tuple[str, ...]) -> Optional[threading.Thread]:
+    """
+    This helper function is used to warm up the listed models on a background thread, once per process,
+    so the page renders while the weights load
+    :param model_names: models to load
+    :return: warm-up thread, None when there is nothing to load
+    """
+    if not model_names:
+        return None
+
+    def warm_up() -> None:
+        try:
+            warm_up_models(list(model_names))
+        except Exception as error:
+            # the models are loaded again on the first request, so a failed warm-up isn't fatal
+            logger.warning("Model warm-up failed: %s", error)
+
+    thread: threading.Thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
 # ------------------LinkedIn keyword dict------------------ #
 def get_keywords(keyword: str, data: dict) -> str:
     """
@@ -49,20 +236,105 @@ def get_keywords(keyword: str, data: dict) -> str:
     return keywords_map[keyword]
 
 
+def compact_profile(profile: dict) -> dict:
+    """
+    This helper function is used to keep only the profile fields used by get_keywords, in the same layout
+    :param profile: returned user profile from LinkedIn API
+    :return: compact user profile
+    """
+    experience: dict = (profile.get("experience") or [{}])[0]
+    education: dict = (profile.get("education") or [{}])[0]
+
+    return {
+        "experience": [{
+            "locationName": experience.get("locationName"),
+            "title": experience.get("title"),
+            "timePeriod": {"startDate": {"year": experience.get("timePeriod", {}).get("startDate", {}).get("year")}},
+            "company": {"industries": experience.get("company", {}).get("industries")},
+        }],
+        "education": [{"fieldOfStudy": education.get("fieldOfStudy")}],
+    }
+
+
 # ------------------UI progress bar------------------ #
-def ui_progress_bar(user_feedback: list[str], amount_of_time: int = 20) -> None:
+def ui_progress_bar(label: str = "AI models hard at work") -> Callable[[StageEvent], None]:
     """
-    This function is used to create a progress bar to improve the UX
-    :param user_feedback: messages to output with the progress bar
-    :param amount_of_time: time taken to sleep
-    :return: None
+    This function is used to create a progress bar that is driven by the pipeline stage events, the bar is only
+    drawn once the first stage starts so a session waiting on a run it doesn't own isn't left with a running status
+    :param label: initial label of the status container
+    :return: listener to subscribe to the pipeline progress
+    """
+    slot: Any = st.empty()
+    widgets: list[Any] = []
+    widgets_lock: threading.Lock = threading.Lock()
+    completed: set[int] = set()
+
+    def on_stage_event(event: StageEvent) -> None:
+        with widgets_lock:
+            if not widgets:
+                status_: Any = slot.container().status(label, expanded=True)
+                widgets.extend([status_, status_.progress(0)])
+        status, bar = widgets
+        if event.state == "running":
+            status.write(event.message)
+            status.update(label=f"Step {event.step} of {event.total}: {event.message}", state="running")
+        elif event.state == "complete":
+            status.write(f"{event.message} ({event.elapsed:.1f}s)")
+            # stages can finish out of order when they run concurrently
+            completed.add(event.step)
+            bar.progress(len(completed) / event.total)
+            finished: bool = len(completed) == event.total
+            status.update(label=f"Step {event.step} of {event.total} complete!",
+                          state="complete" if finished else "running", expanded=not finished)
+        else:
+            status.write(f"Failed after {event.elapsed:.1f}s: {event.message}")
+            status.update(label=f"Step {event.step} of {event.total} failed", state="error", expanded=True)
+
+    return on_stage_event
+
+
+# ------------------UI worker threads------------------ #
+def ui_executor(max_workers: int = 8) -> ThreadPoolExecutor:
+    """
+    This function is used to create worker threads that can update the page of the current Streamlit session
+    :param max_workers: number of worker threads
+    :return: thread pool executor
+    """
+    script_run_context: Any = get_script_run_ctx()
+
+    def attach_context() -> None:
+        add_script_run_ctx(threading.current_thread(), script_run_context)
+
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=attach_context)
+
+
+def ui_session_id() -> str:
+    """
+    This function is used to identify the current Streamlit session, e.g. for fair scheduling
+    :return: session id
     """
-    with st.status("AI models hard at work", expanded=True) as status:
-        st.write(user_feedback[1])
-        time.sleep(amount_of_time)
-        st.write(user_feedback[2])
-        time.sleep(1)
-        status.update(label=f"Download {user_feedback[0]} of 8 complete!", state="complete", expanded=False)
+    script_run_context: Any = get_script_run_ctx()
+    return script_run_context.session_id if script_run_context else "default"
+
+
+def ui_job(function: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    This function is used to wrap a job run on a shared worker so it can update the page of the current session
+    :param function: job
+    :return: job that attaches the session context to the worker while it runs
+    """
+    script_run_context: Any = get_script_run_ctx()
+
+    def run() -> Any:
+        add_script_run_ctx(threading.current_thread(), script_run_context)
+        try:
+            return function()
+        finally:
+            # add_script_run_ctx with None keeps the current context, the attribute is cleared so the worker
+            # doesn't hold on to the session until its next job
+            setattr(threading.current_thread(), SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+    return run
 
 
 # ------------------UI author information------------------ #
@@ -121,6 +393,13 @@ test_data: Any = {
 # ------------------streamlit cities set------------------ #
 cities = ["Amsterdam", "Copenhagen", "Frankfurt", "Hong Kong", "London", "Oslo", "Paris", "Singapore", "Tokyo"]
 
+# ------------------city coordinates (latitude, longitude) for the radius filter------------------ #
+city_coordinates: dict = {
+    "Amsterdam": (52.3676, 4.9041), "Copenhagen": (55.6761, 12.5683), "Frankfurt": (50.1109, 8.6821),
+    "Hong Kong": (22.3193, 114.1694), "London": (51.5072, -0.1276), "Oslo": (59.9139, 10.7522),
+    "Paris": (48.8566, 2.3522), "Singapore": (1.3521, 103.8198), "Tokyo": (35.6762, 139.6503),
+}
+
 # ------------------streamlit salaries list------------------ #
 salaries = [
     "20k-40k", "40k-60k", "60k-80k", "80k-100k", "100k-120k",
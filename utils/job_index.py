@@ -0,0 +1,356 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Optional
+
+from utils.cache import CACHE_DIR
+from utils.chunking import split_by_tokens, strip_boilerplate
+from utils.ranking import detect_city, find_salaries, salary_overlaps, within_radius
+
+logger = logging.getLogger(__name__)
+
+# ------------------job index settings------------------ #
+JOB_INDEX_ENABLED: bool = os.getenv("JOB_INDEX_ENABLED", "true").lower() == "true"
+JOB_INDEX_DIR: str = os.getenv("JOB_INDEX_DIR", os.path.join(CACHE_DIR, "job_index"))
+JOB_INDEX_MODEL: str = os.getenv("JOB_INDEX_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+JOB_INDEX_TTL: float = float(os.getenv("JOB_INDEX_TTL", str(3 * 24 * 60 * 60)))
+JOB_INDEX_MIN_SCORE: float = float(os.getenv("JOB_INDEX_MIN_SCORE", "0.55"))
+JOB_INDEX_CHUNK_WORDS: int = int(os.getenv("JOB_INDEX_CHUNK_WORDS", "200"))
+JOB_INDEX_FLUSH_EVERY: int = int(os.getenv("JOB_INDEX_FLUSH_EVERY", "64"))
+# an index that failed to open (e.g. the embedding model couldn't be downloaded) is retried after this long
+JOB_INDEX_RETRY_SECONDS: float = float(os.getenv("JOB_INDEX_RETRY_SECONDS", "300"))
+# postings past JOB_INDEX_TTL are checked for at most this often, and purged once they pass REBUILD_DEAD_RATIO
+JOB_INDEX_PURGE_SECONDS: float = float(os.getenv("JOB_INDEX_PURGE_SECONDS", str(60 * 60)))
+
+HNSW_NEIGHBOURS: int = 32
+SEARCH_CANDIDATES: int = 64
+# deleted and expired vectors stay in the index file until it is rebuilt, once they pass this share of it
+REBUILD_DEAD_RATIO: float = 0.2
+
+
+# ------------------embeddings------------------ #
+@lru_cache(maxsize=1)
+def embedding_model() -> Any:
+    """
+    This helper function is used to load the sentence embedding model on CPU, once per process
+    :return: sentence transformer
+    """
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(JOB_INDEX_MODEL, device="cpu")
+
+
+def embed(texts: list[str]) -> Any:
+    """
+    This helper function is used to embed texts as unit vectors, so inner product is cosine similarity
+    :param texts: texts to embed
+    :return: float32 array of shape (len(texts), dimension)
+    """
+    return embedding_model().encode(texts, batch_size=32, normalize_embeddings=True,
+                                    convert_to_numpy=True).astype("float32")
+
+
+# ------------------persistent job index------------------ #
+class JobIndex:
+    """
+    This class is used to keep every fetched job page as embedded chunks. Vectors live in an HNSW index file
+    that is loaded into memory, chunk text and metadata live in sqlite. Vectors added since the last
+    flush are searched from memory and are reloaded from sqlite after a restart
+    """
+
+    def __init__(self, directory: str, dimension: int, ttl: float = JOB_INDEX_TTL,
+                 min_score: float = JOB_INDEX_MIN_SCORE) -> None:
+        import numpy as np
+
+        os.makedirs(directory, exist_ok=True)
+        self.dimension: int = dimension
+        self.ttl: float = ttl
+        self.min_score: float = min_score
+        self.index_path: str = os.path.join(directory, "chunks.faiss")
+        self._lock: threading.RLock = threading.RLock()
+
+        self._db: sqlite3.Connection = sqlite3.connect(os.path.join(directory, "chunks.sqlite3"),
+                                                       check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, position INTEGER NOT NULL,
+                text TEXT NOT NULL, city TEXT, salary_low INTEGER, salary_high INTEGER,
+                fetched_at REAL NOT NULL, vector BLOB NOT NULL, indexed INTEGER NOT NULL DEFAULT 0
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_url ON chunks (url)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_fetched_at ON chunks (fetched_at)")
+        self._db.commit()
+
+        self._index: Any = self._read_index() if os.path.exists(self.index_path) else None
+        pending: list = self._db.execute("SELECT id, vector FROM chunks WHERE indexed = 0").fetchall()
+        self._pending_ids: list[int] = [row[0] for row in pending]
+        self._pending_vectors: list = [np.frombuffer(row[1], dtype="float32") for row in pending]
+        indexed_rows: int = self._db.execute("SELECT COUNT(*) FROM chunks WHERE indexed = 1").fetchone()[0]
+        self._dead: int = (self._index.ntotal - indexed_rows) if self._index is not None else 0
+        self._purge_at: float = time.monotonic()
+
+    # ------------------index file------------------ #
+    def _new_index(self) -> Any:
+        import faiss
+
+        return faiss.IndexIDMap2(faiss.IndexHNSWFlat(self.dimension, HNSW_NEIGHBOURS, faiss.METRIC_INNER_PRODUCT))
+
+    def _read_index(self) -> Any:
+        import faiss
+
+        return faiss.read_index(self.index_path)
+
+    def _write_index(self, index: Any) -> None:
+        import faiss
+
+        temporary_path: str = f"{self.index_path}.{os.getpid()}.tmp"
+        faiss.write_index(index, temporary_path)
+        os.replace(temporary_path, self.index_path)
+        self._index = self._read_index()
+
+    def _expired(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM chunks WHERE indexed = 1 AND fetched_at < ?",
+                                (time.time() - self.ttl,)).fetchone()[0]
+
+    def flush(self) -> None:
+        """
+        This function is used to move the vectors added since the last flush into the index file, the file is
+        rebuilt without stale and replaced postings once enough of it is dead
+        :return: None
+        """
+        import numpy as np
+
+        with self._lock:
+            rebuild: bool = (self._index is not None
+                             and self._dead + self._expired() > self._index.ntotal * REBUILD_DEAD_RATIO)
+            if not self._pending_ids and not rebuild:
+                return
+
+            if rebuild:
+                self._db.execute("DELETE FROM chunks WHERE fetched_at < ?", (time.time() - self.ttl,))
+                rows: list = self._db.execute("SELECT id, vector FROM chunks").fetchall()
+                ids: list[int] = [row[0] for row in rows]
+                vectors: list = [np.frombuffer(row[1], dtype="float32") for row in rows]
+                index: Any = self._new_index()
+            else:
+                ids, vectors = self._pending_ids, self._pending_vectors
+                index: Any = self._read_index() if self._index is not None else self._new_index()
+
+            if ids:
+                index.add_with_ids(np.vstack(vectors), np.array(ids, dtype="int64"))
+            self._write_index(index)
+
+            self._db.executemany("UPDATE chunks SET indexed = 1 WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._db.commit()
+            self._pending_ids, self._pending_vectors = [], []
+            if rebuild:
+                self._dead = 0
+
+    # ------------------adding postings------------------ #
+    def add_documents(self, documents: list) -> int:
+        """
+        This function is used to chunk, embed and store fetched job pages, a page fetched again replaces
+        its earlier chunks
+        :param documents: page documents with the url in metadata["source"]
+        :return: number of chunks added
+        """
+        pages: list[tuple[str, list[str], Optional[str], list[int]]] = []
+        for document in documents:
+            url: Optional[str] = document.metadata.get("source")
+            chunks: list[str] = split_by_tokens(strip_boilerplate(document.page_content),
+                                                max_tokens=JOB_INDEX_CHUNK_WORDS, count=lambda text: len(text.split()))
+            if url and chunks:
+                pages.append((url, chunks, detect_city(document.page_content),
+                              find_salaries(document.page_content)))
+        if not pages:
+            return 0
+
+        # embedding is the slow part, it runs outside the lock
+        vectors: Any = embed([chunk for _, chunks, _, _ in pages for chunk in chunks])
+        fetched_at: float = time.time()
+        offset: int = 0
+
+        with self._lock:
+            for url, chunks, city, salaries_found in pages:
+                self._remove_url(url)
+                for position, chunk in enumerate(chunks):
+                    vector: Any = vectors[offset]
+                    offset += 1
+                    cursor: sqlite3.Cursor = self._db.execute(
+                        "INSERT INTO chunks (url, position, text, city, salary_low, salary_high, fetched_at, vector) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (url, position, chunk, city, min(salaries_found, default=None),
+                         max(salaries_found, default=None), fetched_at, vector.tobytes()))
+                    self._pending_ids.append(cursor.lastrowid)
+                    self._pending_vectors.append(vector)
+            self._db.commit()
+
+            if len(self._pending_ids) >= JOB_INDEX_FLUSH_EVERY:
+                self.flush()
+        self._purge_if_due()
+        return offset
+
+    def _purge_if_due(self) -> None:
+        # postings expire without being fetched again, so the dead share is also checked on a timer. The check
+        # runs on its own thread so a rebuild doesn't hold up the search or fetch that noticed it was due
+        with self._lock:
+            if time.monotonic() < self._purge_at:
+                return
+            self._purge_at = time.monotonic() + JOB_INDEX_PURGE_SECONDS
+        threading.Thread(target=self.flush, name="job-index-purge", daemon=True).start()
+
+    def _remove_url(self, url: str) -> None:
+        rows: list = self._db.execute("SELECT id, indexed FROM chunks WHERE url = ?", (url,)).fetchall()
+        removed_pending: set[int] = {chunk_id for chunk_id, indexed in rows if not indexed}
+        if removed_pending:
+            kept: list[tuple[int, Any]] = [(chunk_id, vector) for chunk_id, vector
+                                           in zip(self._pending_ids, self._pending_vectors)
+                                           if chunk_id not in removed_pending]
+            self._pending_ids = [chunk_id for chunk_id, _ in kept]
+            self._pending_vectors = [vector for _, vector in kept]
+        self._dead += len(rows) - len(removed_pending)
+        self._db.execute("DELETE FROM chunks WHERE url = ?", (url,))
+
+    # ------------------searching------------------ #
+    def _search(self, query: str, candidates: int = SEARCH_CANDIDATES) -> dict[int, float]:
+        import numpy as np
+
+        vector: Any = embed([query])
+        with self._lock:
+            index: Any = self._index
+            pending_ids: list[int] = list(self._pending_ids)
+            pending_vectors: list = list(self._pending_vectors)
+
+        scores: dict[int, float] = {}
+        if index is not None and index.ntotal:
+            found_scores, found_ids = index.search(vector, candidates)
+            scores.update({int(chunk_id): float(score) for chunk_id, score in zip(found_ids[0], found_scores[0])
+                           if chunk_id != -1})
+        if pending_ids:
+            pending_scores: Any = np.vstack(pending_vectors) @ vector[0]
+            for position in np.argsort(-pending_scores)[:candidates]:
+                scores[pending_ids[position]] = float(pending_scores[position])
+        return scores
+
+    def find_postings(self, query: str, count: int, location: Optional[str] = None,
+                      band: Optional[tuple[int, int]] = None, radius_km: Optional[float] = None) -> list:
+        """
+        This function is used to answer a job search from the index: chunks are matched by meaning, stale
+        postings and postings outside the location, radius or salary band are dropped, and the best pages
+        are returned whole
+        :param query: job search query
+        :param count: number of postings wanted
+        :param location: location from the form
+        :param band: salary band from the form
+        :param radius_km: radius from the form
+        :return: list of page documents, empty when the index can't answer with enough fresh postings
+        """
+        self._purge_if_due()
+        scores: dict[int, float] = self._search(query)
+        if not scores:
+            return []
+
+        with self._lock:
+            placeholders: str = ",".join("?" * len(scores))
+            rows: list = self._db.execute(
+                f"SELECT id, url, city, salary_low, salary_high, fetched_at FROM chunks WHERE id IN ({placeholders})",
+                list(scores)).fetchall()
+
+        now: float = time.time()
+        best: dict[str, float] = {}
+        for chunk_id, url, city, salary_low, salary_high, fetched_at in rows:
+            # like posting_matches, a posting that names no known city is kept
+            if now - fetched_at > self.ttl or (city is not None and not within_radius(city, location, radius_km)):
+                continue
+            if not salary_overlaps(salary_low, salary_high, band):
+                continue
+            best[url] = max(best.get(url, -1.0), scores[chunk_id])
+
+        urls: list[str] = [url for url, score in sorted(best.items(), key=lambda pair: -pair[1])
+                           if score >= self.min_score][:count]
+        if len(urls) < count:
+            return []
+        return [self.posting(url) for url in urls]
+
+    def posting(self, url: str) -> Any:
+        """
+        This function is used to put the stored chunks of a page back together
+        :param url: page url
+        :return: page document
+        """
+        from langchain.schema import Document
+
+        with self._lock:
+            rows: list = self._db.execute("SELECT text, fetched_at FROM chunks WHERE url = ? ORDER BY position",
+                                          (url,)).fetchall()
+        return Document(page_content="\n\n".join(text for text, _ in rows),
+                        metadata={"source": url, "indexed_at": rows[0][1] if rows else None})
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM chunks")
+            self._db.commit()
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self._index = None
+            self._pending_ids, self._pending_vectors, self._dead = [], [], 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+# ------------------process-wide index------------------ #
+_job_index: Optional[JobIndex] = None
+_job_index_lock: threading.Lock = threading.Lock()
+_job_index_retry_at: float = 0.0
+
+
+def job_index(wait: bool = True) -> Optional[JobIndex]:
+    """
+    This function is used to open the shared job index once per process. The index is switched off when
+    JOB_INDEX_ENABLED is false or faiss/sentence-transformers aren't installed; any other failure to open it
+    (embedding model download, sqlite) skips the index until JOB_INDEX_RETRY_SECONDS have passed
+    :param wait: False to start opening the index on a background thread instead of waiting for it, used on
+    the request path where the first load (importing torch, downloading the embedding model) would time out
+    :return: job index or None, None while it is still being opened when wait is False
+    """
+    global _job_index, _job_index_retry_at
+
+    if not JOB_INDEX_ENABLED:
+        return None
+    if not wait:
+        if _job_index is None and time.monotonic() >= _job_index_retry_at and not _job_index_lock.locked():
+            threading.Thread(target=job_index, name="job-index-load", daemon=True).start()
+        return _job_index
+    with _job_index_lock:
+        if _job_index is not None or time.monotonic() < _job_index_retry_at:
+            return _job_index
+        try:
+            _job_index = JobIndex(directory=JOB_INDEX_DIR,
+                                  dimension=embedding_model().get_sentence_embedding_dimension())
+        except ImportError as error:
+            logger.warning("Job index disabled: %s", error)
+            _job_index_retry_at = float("inf")
+        except Exception as error:
+            logger.warning("Job index unavailable, retrying in %.0fs: %s", JOB_INDEX_RETRY_SECONDS, error)
+            _job_index_retry_at = time.monotonic() + JOB_INDEX_RETRY_SECONDS
+        return _job_index
+
+
+def index_job_pages(documents: list) -> None:
+    """
+    This helper function is used to add fetched pages to the job index, a failure only costs the index entry
+    :param documents: page documents
+    :return: None
+    """
+    index: Optional[JobIndex] = job_index(wait=False)
+    if index is None or not documents:
+        return
+    try:
+        index.add_documents(documents)
+    except Exception as error:
+        logger.warning("Could not index %d pages: %s", len(documents), error)
@@ -0,0 +1,276 @@
+import copy
+from collections import OrderedDict
+from threading import Lock, Thread
+from typing import Any, Iterator, Optional
+
+from langchain.llms.base import LLM
+from langchain.schema import Generation, LLMResult
+
+
+# ------------------langchain wrapper around a shared huggingface pipeline------------------ #
+class LocalPipelineLLM(LLM):
+    """
+    This class is used to call a shared text-generation pipeline with per-engine generation settings,
+    prompts are generated in batches and can be streamed token by token
+    """
+
+    pipeline: Any
+    generation_kwargs: dict = {}
+    batch_size: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "local_pipeline"
+
+    def _generate_texts(self, prompts: list[str]) -> list[str]:
+        texts: list[str] = []
+        for start in range(0, len(prompts), self.batch_size):
+            batch: list[str] = prompts[start:start + self.batch_size]
+            responses: list = self.pipeline(batch, batch_size=len(batch), return_full_text=False,
+                                            **self.generation_kwargs)
+            texts += [response[0]["generated_text"] for response in responses]
+        return texts
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return self._generate_texts([prompt])[0]
+
+    def _generate(self, prompts: list[str], stop: Optional[list[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> LLMResult:
+        return LLMResult(generations=[[Generation(text=text)] for text in self._generate_texts(prompts)])
+
+    def generate_constrained(self, prompt: str, choices: list[str]) -> str:
+        """
+        This function is used to generate greedily while only allowing the tokens of one of the choices
+        :param prompt: formatted prompt
+        :param choices: allowed completions
+        :return: completion, one of the choices
+        """
+        from utils.structured import choice_constraint
+
+        tokenizer: Any = self.pipeline.tokenizer
+        allowed_tokens, max_new_tokens = choice_constraint(tokenizer, choices, len(tokenizer(prompt).input_ids))
+        response: list = self.pipeline(prompt, return_full_text=False, do_sample=False, max_new_tokens=max_new_tokens,
+                                       prefix_allowed_tokens_fn=allowed_tokens)
+        return response[0]["generated_text"]
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        """
+        This function is used to yield the generated text as the pipeline produces it
+        :param prompt: formatted prompt
+        :return: iterator of text pieces
+        """
+        from transformers import TextIteratorStreamer
+
+        streamer: Any = TextIteratorStreamer(self.pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation: Thread = Thread(target=self.pipeline, args=(prompt,),
+                                    kwargs={"streamer": streamer, **self.generation_kwargs}, daemon=True)
+        generation.start()
+        yield from streamer
+        generation.join()
+
+
+# ------------------CPU tuned local engine------------------ #
+supported_quantisations: tuple = ("int8", "bf16", "fp32")
+
+
+class CPUCausalLMEngine:
+    """
+    This class is used to run a causal language model on CPU: safetensors weights are memory-mapped on load,
+    linear layers are dynamically quantised to int8 (or kept in bf16), prompts are generated in left-padded
+    batches, and the key/value cache of registered prompt prefixes is computed once and reused.
+    Any causal LM id works, so a tiny model (e.g. sshleifer/tiny-gpt2) can stand in for Llama
+    """
+
+    def __init__(self, model_id: str, quantisation: str = "int8", threads: Optional[int] = None,
+                 max_prefixes: int = 8) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if quantisation not in supported_quantisations:
+            raise ValueError(f"Unsupported quantisation {quantisation}, choose from {supported_quantisations}")
+        if threads:
+            torch.set_num_threads(threads)
+
+        self.model_id: str = model_id
+        self.quantisation: str = quantisation
+        self.max_prefixes: int = max_prefixes
+        self._prefixes: OrderedDict = OrderedDict()
+        self._lock: Lock = Lock()
+
+        self.tokenizer: Any = AutoTokenizer.from_pretrained(model_id)
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # low_cpu_mem_usage with safetensors maps the weight files instead of copying them into a fresh state dict
+        model: Any = AutoModelForCausalLM.from_pretrained(
+            model_id, torch_dtype=torch.bfloat16 if quantisation == "bf16" else torch.float32,
+            low_cpu_mem_usage=True)
+        if quantisation == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model: Any = model.eval()
+
+    def footprint(self) -> int:
+        """
+        This function is used to report the memory held by the model parameters and buffers
+        :return: bytes
+        """
+        tensors: list = list(self.model.parameters()) + list(self.model.buffers())
+        packed: int = sum(param.numel() * param.element_size() for param in tensors)
+        # dynamically quantised linear layers keep their weights in packed params, not parameters
+        for module in self.model.modules():
+            weight: Any = getattr(module, "weight", None)
+            if callable(weight):
+                packed += weight().numel()
+        return packed
+
+    def _generation_kwargs(self, max_new_tokens: int, temperature: float) -> dict:
+        generation_kwargs: dict = {"max_new_tokens": max_new_tokens, "pad_token_id": self.tokenizer.pad_token_id,
+                                   "do_sample": temperature > 0}
+        if temperature > 0:
+            generation_kwargs["temperature"] = temperature
+        return generation_kwargs
+
+    # ------------------prefix key/value cache------------------ #
+    def register_prefix(self, prefix: str) -> None:
+        """
+        This function is used to encode a fixed prompt prefix once and keep its key/value cache
+        :param prefix: static start of a prompt template
+        :return: None
+        """
+        import torch
+
+        with self._lock:
+            if prefix in self._prefixes:
+                self._prefixes.move_to_end(prefix)
+                return
+        prefix_ids: Any = self.tokenizer(prefix, return_tensors="pt").input_ids
+        with torch.inference_mode():
+            past_key_values: Any = self.model(prefix_ids, use_cache=True).past_key_values
+        with self._lock:
+            self._prefixes[prefix] = (prefix_ids, past_key_values)
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+
+    def _encode(self, prompt: str) -> tuple[Any, Any]:
+        import torch
+
+        with self._lock:
+            match: Optional[str] = max((prefix for prefix in self._prefixes if prompt.startswith(prefix)),
+                                       key=len, default=None)
+            cached: Any = self._prefixes[match] if match else None
+        if cached is None:
+            return self.tokenizer(prompt, return_tensors="pt").input_ids, None
+
+        prefix_ids, past_key_values = cached
+        rest_ids: Any = self.tokenizer(prompt[len(match):], add_special_tokens=False, return_tensors="pt").input_ids
+        # generate extends the cache in place, every call gets its own copy
+        return torch.cat([prefix_ids, rest_ids], dim=-1), copy.deepcopy(past_key_values)
+
+    # ------------------generation------------------ #
+    def generate(self, prompts: list[str], max_new_tokens: int = 256, temperature: float = 0.0) -> list[str]:
+        """
+        This function is used to generate completions, several prompts run as one left-padded batch
+        and a single prompt reuses the cached prefix when one matches
+        :param prompts: formatted prompts
+        :param max_new_tokens: max number of generated tokens
+        :param temperature: randomness of model output
+        :return: list of completions
+        """
+        import torch
+
+        generation_kwargs: dict = self._generation_kwargs(max_new_tokens, temperature)
+        with torch.inference_mode():
+            if len(prompts) == 1:
+                input_ids, past_key_values = self._encode(prompts[0])
+                output: Any = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                                  past_key_values=past_key_values, **generation_kwargs)
+            else:
+                encoded: Any = self.tokenizer(prompts, return_tensors="pt", padding=True)
+                input_ids = encoded.input_ids
+                output: Any = self.model.generate(**encoded, **generation_kwargs)
+
+        return self.tokenizer.batch_decode(output[:, input_ids.shape[-1]:], skip_special_tokens=True)
+
+    def generate_constrained(self, prompt: str, choices: list[str]) -> str:
+        """
+        This function is used to generate greedily while a trie of the tokenized choices masks every step,
+        so the completion is always one of the choices. The prompt reuses the cached prefix when one matches
+        :param prompt: formatted prompt
+        :param choices: allowed completions
+        :return: completion, one of the choices
+        """
+        import torch
+        from utils.structured import choice_constraint
+
+        input_ids, past_key_values = self._encode(prompt)
+        allowed_tokens, max_new_tokens = choice_constraint(self.tokenizer, choices, input_ids.shape[-1])
+        with torch.inference_mode():
+            output: Any = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                              past_key_values=past_key_values, prefix_allowed_tokens_fn=allowed_tokens,
+                                              **self._generation_kwargs(max_new_tokens, temperature=0.0))
+
+        return self.tokenizer.decode(output[0, input_ids.shape[-1]:], skip_special_tokens=True)
+
+    def stream(self, prompt: str, max_new_tokens: int = 256, temperature: float = 0.0) -> Iterator[str]:
+        """
+        This function is used to yield the completion of a prompt as it is generated
+        :param prompt: formatted prompt
+        :param max_new_tokens: max number of generated tokens
+        :param temperature: randomness of model output
+        :return: iterator of text pieces
+        """
+        import torch
+        from transformers import TextIteratorStreamer
+
+        input_ids, past_key_values = self._encode(prompt)
+        streamer: Any = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def run() -> None:
+            with torch.inference_mode():
+                self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                    past_key_values=past_key_values, streamer=streamer,
+                                    **self._generation_kwargs(max_new_tokens, temperature))
+
+        generation: Thread = Thread(target=run, daemon=True)
+        generation.start()
+        yield from streamer
+        generation.join()
+
+
+class CPUEngineLLM(LLM):
+    """
+    This class is used to expose a shared CPUCausalLMEngine to langchain with per-engine generation settings
+    """
+
+    engine: Any
+    max_new_tokens: int = 256
+    temperature: float = 0.0
+    batch_size: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "cpu_causal_lm"
+
+    def _generate_texts(self, prompts: list[str]) -> list[str]:
+        texts: list[str] = []
+        for start in range(0, len(prompts), self.batch_size):
+            texts += self.engine.generate(prompts[start:start + self.batch_size], max_new_tokens=self.max_new_tokens,
+                                          temperature=self.temperature)
+        return texts
+
+    def _call(self, prompt: str, stop: Optional[list[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return self._generate_texts([prompt])[0]
+
+    def _generate(self, prompts: list[str], stop: Optional[list[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> LLMResult:
+        return LLMResult(generations=[[Generation(text=text)] for text in self._generate_texts(prompts)])
+
+    def generate_constrained(self, prompt: str, choices: list[str]) -> str:
+        return self.engine.generate_constrained(prompt, choices)
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        return self.engine.stream(prompt, max_new_tokens=self.max_new_tokens, temperature=self.temperature)
+
+    def register_prefix(self, prefix: str) -> None:
+        self.engine.register_prefix(prefix)
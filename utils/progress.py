@@ -0,0 +1,87 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+
+# ------------------stage event------------------ #
+@dataclass(frozen=True)
+class StageEvent:
+    stage: str
+    state: str
+    step: int
+    total: int
+    message: str
+    elapsed: Optional[float] = None
+
+
+# ------------------pipeline progress------------------ #
+class PipelineProgress:
+    """
+    This class is used to emit stage start/finish events as the pipeline runs, listeners render or record them
+    """
+
+    def __init__(self, stage_map: dict, listeners: Optional[list[Callable[[StageEvent], None]]] = None) -> None:
+        self.stage_map: dict = stage_map
+        self.listeners: list[Callable[[StageEvent], None]] = list(listeners or [])
+        self.timings: dict[str, float] = {}
+        self._started: dict[str, float] = {}
+
+    def emit(self, event: StageEvent) -> None:
+        for listener in self.listeners:
+            listener(event)
+
+    def start(self, name: str) -> None:
+        """
+        This function is used to mark a stage as running
+        :param name: key of the stage in the stage map
+        :return: None
+        """
+        step, running_message, _ = self.stage_map[name]
+        self._started[name] = time.perf_counter()
+        self.emit(StageEvent(stage=name, state="running", step=step, total=len(self.stage_map),
+                             message=running_message))
+
+    def finish(self, name: str, error: Optional[BaseException] = None) -> None:
+        """
+        This function is used to mark a stage as complete, or failed when an error is given
+        :param name: key of the stage in the stage map
+        :param error: optional error raised by the stage
+        :return: None
+        """
+        step, _, complete_message = self.stage_map[name]
+        elapsed: float = time.perf_counter() - self._started.pop(name, time.perf_counter())
+        self.timings[name] = elapsed
+        self.emit(StageEvent(stage=name, state="error" if error else "complete", step=step,
+                             total=len(self.stage_map), message=str(error) if error else complete_message,
+                             elapsed=elapsed))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        This function is used to wrap a pipeline stage, emitting events when it starts, finishes or fails
+        :param name: key of the stage in the stage map
+        :return: None
+        """
+        self.start(name)
+        try:
+            yield
+        except Exception as error:
+            self.finish(name, error=error)
+            raise
+        self.finish(name)
+
+
+def run_stage(progress: Optional[PipelineProgress], name: str, function: Callable, **kwargs: Any) -> Any:
+    """
+    This helper function is used to run a pipeline function inside a progress stage when a tracker is given
+    :param progress: optional progress tracker
+    :param name: key of the stage in the stage map
+    :param function: pipeline function
+    :param kwargs: arguments for the pipeline function
+    :return: pipeline function result
+    """
+    if progress is None:
+        return function(**kwargs)
+    with progress.stage(name):
+        return function(**kwargs)
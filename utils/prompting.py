@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from utils.helper import huggingface_login, model_backend
+from utils.telemetry import metrics_logger
+
+logger = logging.getLogger(__name__)
+
+# ------------------model context windows------------------ #
+model_token_limits: dict = {
+    "gpt-3.5-turbo": 4096,
+    "meta-llama/Llama-2-7b-chat-hf": 2048,
+}
+
+DEFAULT_TOKEN_LIMIT: int = 2048
+DEFAULT_COMPLETION_TOKENS: int = 500
+
+# ------------------completion caps per backend------------------ #
+max_completion_tokens: dict = {
+    "openai": int(os.getenv("OPENAI_MAX_COMPLETION_TOKENS", "1000")),
+    "huggingface": int(os.getenv("HUGGINGFACE_MAX_COMPLETION_TOKENS", "512")),
+}
+
+# an array of two urls never needs more
+URL_SELECTION_MAX_TOKENS: int = 100
+
+
+# ------------------tokenizers------------------ #
+# tokenizers of models that aren't on the hub, such as the benchmark stand-in model
+registered_tokenizers: dict = {}
+
+
+@lru_cache(maxsize=8)
+def get_tokenizer(model: str) -> Any:
+    """
+    This helper function is used to load the tokenizer matching the model, once per process
+    :param model: generative model
+    :return: tokenizer with an encode method
+    """
+    if model in registered_tokenizers:
+        return registered_tokenizers[model]
+
+    if model_backend(model) == "openai":
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+
+    from transformers import AutoTokenizer
+
+    huggingface_login()
+    return AutoTokenizer.from_pretrained(model)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    This helper function is used to count the tokens of the text with the model tokenizer
+    :param text: text to count
+    :param model: generative model
+    :return: number of tokens
+    """
+    tokenizer: Any = get_tokenizer(model)
+    if model_backend(model) == "openai":
+        return len(tokenizer.encode(text))
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def completion_token_limit(model: str, max_tokens: Optional[int] = None) -> int:
+    """
+    This helper function is used to cap the completion tokens requested from the sidebar by the backend limit
+    :param model: generative model
+    :param max_tokens: max number of tokens from the sidebar
+    :return: completion token limit
+    """
+    return min(max_tokens or DEFAULT_COMPLETION_TOKENS, max_completion_tokens[model_backend(model)])
+
+
+def prompt_token_budget(model: str, template: str, completion_tokens: int = DEFAULT_COMPLETION_TOKENS) -> int:
+    """
+    This helper function is used to work out how many tokens are left for the variable part of a prompt
+    :param model: generative model
+    :param template: prompt template, counted without its variables
+    :param completion_tokens: tokens reserved for the completion
+    :return: token budget
+    """
+    limit: int = model_token_limits.get(model, DEFAULT_TOKEN_LIMIT)
+    return max(limit - count_tokens(template, model) - completion_tokens, 0)
+
+
+# ------------------search result compaction------------------ #
+def _domain(link: str) -> str:
+    return urlparse(link).netloc.lower().removeprefix("www.")
+
+
+def _terms(text: str) -> set[str]:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def extract_organic_results(response_data: dict) -> list[dict]:
+    """
+    This helper function is used to keep only the title, link and snippet of the organic search results
+    :param response_data: serper response
+    :return: list of organic results
+    """
+    return [
+        {"title": result.get("title", ""), "link": result["link"], "snippet": result.get("snippet", "")}
+        for result in response_data.get("organic", [])
+        if result.get("link")
+    ]
+
+
+def dedupe_domains(results: list[dict]) -> list[dict]:
+    """
+    This helper function is used to keep the first result of each domain
+    :param results: organic results
+    :return: results with unique domains
+    """
+    seen: set[str] = set()
+    unique_results: list[dict] = []
+    for result in results:
+        domain: str = _domain(result["link"])
+        if domain not in seen:
+            seen.add(domain)
+            unique_results.append(result)
+    return unique_results
+
+
+def rank_by_query(results: list[dict], query: str) -> list[dict]:
+    """
+    This helper function is used to order results by how many query terms they mention, keeping search order on ties
+    :param results: organic results
+    :param query: search query
+    :return: ranked results
+    """
+    query_terms: set[str] = _terms(query)
+    return sorted(results, key=lambda result: -len(query_terms & _terms(f"{result['title']} {result['snippet']}")))
+
+
+def compact_search_results(response_data: dict, query: str, model: str, budget: int,
+                           ranked_results: Optional[list[dict]] = None) -> tuple[str, int]:
+    """
+    This function is used to turn the serper response into the smallest useful prompt context:
+    organic results only, one per domain, ranked against the query and truncated to the token budget
+    :param response_data: serper response
+    :param query: search query
+    :param model: generative model
+    :param budget: max number of tokens for the context
+    :param ranked_results: optional results already ranked, used in that order instead of ranking by the query
+    :return: (context string, number of tokens)
+    """
+    results: list[dict] = ranked_results if ranked_results is not None else \
+        rank_by_query(dedupe_domains(extract_organic_results(response_data)), query)
+
+    lines: list[str] = []
+    used_tokens: int = 0
+    for result in results:
+        line: str = json.dumps(result, ensure_ascii=False)
+        line_tokens: int = count_tokens(line + "\n", model)
+        if used_tokens + line_tokens > budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+
+    return "\n".join(lines), used_tokens
+
+
+def log_prompt_tokens(stage: str, prompt: str, model: str) -> int:
+    """
+    This helper function is used to report the number of prompt tokens sent by a pipeline stage, as a JSON
+    line on the metrics logger
+    :param stage: pipeline stage
+    :param prompt: formatted prompt
+    :param model: generative model
+    :return: number of prompt tokens
+    """
+    prompt_tokens: int = count_tokens(prompt, model)
+    metrics_logger.info(json.dumps({"event": "prompt_tokens", "stage": stage, "model": model,
+                                    "prompt_tokens": prompt_tokens}))
+    return prompt_tokens
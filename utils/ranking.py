@@ -0,0 +1,219 @@
+import math
+import re
+from typing import Optional
+from urllib.parse import urlparse
+
+from utils.helper import city_coordinates
+
+# ------------------known job boards------------------ #
+job_board_domains: tuple = (
+    "linkedin.com", "indeed.com", "indeed.co.uk", "glassdoor.com", "glassdoor.co.uk", "reed.co.uk",
+    "totaljobs.com", "cwjobs.co.uk", "monster.com", "ziprecruiter.com", "otta.com", "stepstone.de",
+    "welcometothejungle.com", "jobs.ch", "jobsdb.com", "seek.com.au", "careerjet.com"
+)
+
+# ------------------ranking weights------------------ #
+ranking_weights: dict = {
+    "title": 3.0,
+    "snippet": 1.5,
+    "job_board": 1.5,
+    "location": 1.0,
+    "salary_in_band": 1.0,
+    "salary_mentioned": 0.25,
+}
+
+# a single weight is worth 0.25 (salary mentioned) or more, a smaller gap is a close call
+AMBIGUITY_MARGIN: float = 0.25
+# picks below this share too few profile terms to go without the model
+MIN_CONFIDENT_SCORE: float = 2.0
+# a job board result whose title and snippet share most profile terms, picks this good are kept even on a close
+# call, the model would only be choosing among equally good postings
+CLEAR_MATCH_SCORE: float = 4.0
+
+
+def _terms(text: str) -> set[str]:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+# ------------------salary parsing------------------ #
+def salary_band(salary: Optional[str]) -> Optional[tuple[int, int]]:
+    """
+    This helper function is used to turn a salary option such as "60k-80k" into a numeric band
+    :param salary: salary option from the form
+    :return: (lower, upper) or None
+    """
+    if not salary:
+        return None
+    bounds: list[str] = re.findall(r"(\d+)\s*k", salary.lower())
+    if len(bounds) != 2:
+        return None
+    return int(bounds[0]) * 1000, int(bounds[1]) * 1000
+
+
+_currency: str = r"(?:HK\$|S\$|[£$€¥]|\bkr\b\.?|\b(?:gbp|usd|eur|dkk|nok|hkd|sgd|jpy|chf)\b)"
+# "65,000", "70.000" and "70 000" are thousands, as are plain 4-6 digit amounts such as "65000"
+_salary_amount: re.Pattern = re.compile(
+    rf"(?P<before>{_currency})?\s?(?<![\d.,])(?P<amount>\d{{1,3}}(?:[,. \u00a0\u202f]\d{{3}})+|\d{{2,6}})(?!\d)"
+    rf"(?:\s?(?P<thousands>k)\b)?(?:\s?(?P<after>{_currency}))?", flags=re.IGNORECASE)
+_salary_wording: re.Pattern = re.compile(
+    r"salary|\bpay\b|per (annum|year|hour|day)|\bp\.?a\b|a year|compensation|\bbase\b|\bote\b|package|gehalt|salaire|"
+    r"salaris|\bløn|brutto",
+    flags=re.IGNORECASE)
+SALARY_WORDING_WINDOW: int = 40
+
+
+def find_salaries(text: str) -> list[int]:
+    """
+    This helper function is used to find salary figures such as "£65,000", "$90k", "70.000 €" or "70 000 kr" in
+    text. A plain number such as "12,500 employees" only counts with a currency or salary wording close by
+    :param text: text to search
+    :return: list of salaries
+    """
+    salaries_found: list[int] = []
+    for match in _salary_amount.finditer(text):
+        currency: Optional[str] = match.group("before") or match.group("after")
+        amount: str = match.group("amount")
+        thousands: Optional[str] = match.group("thousands")
+        nearby: str = text[max(match.start() - SALARY_WORDING_WINDOW, 0):match.end() + SALARY_WORDING_WINDOW]
+        if not (currency or thousands or _salary_wording.search(nearby)):
+            continue
+        value: int = int(re.sub(r"\D", "", amount))
+        if thousands and value < 1000:
+            salaries_found.append(value * 1000)
+        elif len(amount) >= 4:
+            salaries_found.append(value)
+    return [value for value in salaries_found if 10_000 <= value <= 1_000_000]
+
+
+def salary_overlaps(low: Optional[int], high: Optional[int], band: Optional[tuple[int, int]]) -> bool:
+    # postings that don't state a salary are kept, the summariser filters on salary later
+    if band is None or low is None:
+        return True
+    return low <= band[1] and high >= band[0]
+
+
+# ------------------location filters------------------ #
+def distance_km(first: tuple[float, float], second: tuple[float, float]) -> float:
+    """
+    This helper function is used to measure the great-circle distance between two coordinates
+    :param first: (latitude, longitude)
+    :param second: (latitude, longitude)
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (*first, *second))
+    a: float = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def detect_city(text: str) -> Optional[str]:
+    """
+    This helper function is used to find the known city a posting mentions most
+    :param text: posting text
+    :return: city or None
+    """
+    mentions: dict[str, int] = {city: len(re.findall(rf"\b{re.escape(city)}\b", text, flags=re.IGNORECASE))
+                                for city in city_coordinates}
+    city, count = max(mentions.items(), key=lambda pair: pair[1])
+    return city if count else None
+
+
+def within_radius(city: Optional[str], location: Optional[str], radius_km: Optional[float]) -> bool:
+    """
+    This helper function is used to check a posting city against the location and radius from the form
+    :param city: city of the posting
+    :param location: location from the form
+    :param radius_km: radius from the form, 0 keeps the location itself
+    :return: True when the posting is close enough
+    """
+    if not location:
+        return True
+    if city not in city_coordinates or location not in city_coordinates:
+        return city == location
+    return distance_km(city_coordinates[city], city_coordinates[location]) <= (radius_km or 0)
+
+
+def posting_matches(text: str, location: Optional[str] = None, salary: Optional[str] = None,
+                    radius_km: Optional[float] = None) -> bool:
+    """
+    This function is used to check a fetched posting against the form filters. A posting that names no salary
+    or no known city is kept, the search was already narrowed to the location
+    :param text: posting text
+    :param location: location from the form
+    :param salary: salary option from the form
+    :param radius_km: radius from the form
+    :return: True when the posting passes the filters
+    """
+    found_salaries: list[int] = find_salaries(text)
+    if not salary_overlaps(min(found_salaries, default=None), max(found_salaries, default=None), salary_band(salary)):
+        return False
+    city: Optional[str] = detect_city(text)
+    return city is None or within_radius(city, location, radius_km)
+
+
+# ------------------deterministic ranking------------------ #
+def score_result(result: dict, keywords: list[str], location: Optional[str] = None,
+                 salary: Optional[str] = None) -> float:
+    """
+    This function is used to score a search result against the profile keywords and the form values
+    :param result: organic result with title, link and snippet
+    :param keywords: profile keywords
+    :param location: location from the form
+    :param salary: salary option from the form
+    :return: score
+    """
+    keyword_terms: set[str] = set().union(*(_terms(keyword) for keyword in keywords)) if keywords else set()
+    title_terms: set[str] = _terms(result.get("title", ""))
+    snippet: str = result.get("snippet", "")
+    text: str = f"{result.get('title', '')} {snippet}"
+
+    score: float = 0.0
+    if keyword_terms:
+        score += ranking_weights["title"] * len(keyword_terms & title_terms) / len(keyword_terms)
+        score += ranking_weights["snippet"] * len(keyword_terms & _terms(snippet)) / len(keyword_terms)
+
+    domain: str = urlparse(result.get("link", "")).netloc.lower().removeprefix("www.")
+    if any(domain == board or domain.endswith(f".{board}") for board in job_board_domains):
+        score += ranking_weights["job_board"]
+
+    if location and location.lower() in text.lower():
+        score += ranking_weights["location"]
+
+    found_salaries: list[int] = find_salaries(text)
+    band: Optional[tuple[int, int]] = salary_band(salary)
+    if found_salaries:
+        score += ranking_weights["salary_mentioned"]
+        if band and any(band[0] <= value <= band[1] for value in found_salaries):
+            score += ranking_weights["salary_in_band"]
+
+    return round(score, 4)
+
+
+def rank_job_results(results: list[dict], keywords: list[str], location: Optional[str] = None,
+                     salary: Optional[str] = None) -> list[tuple[float, dict]]:
+    """
+    This function is used to order the search results by score, ties keep the search engine order
+    :param results: organic results
+    :param keywords: profile keywords
+    :param location: location from the form
+    :param salary: salary option from the form
+    :return: list of (score, result) pairs, best first
+    """
+    scored: list[tuple[float, dict]] = [(score_result(result, keywords, location, salary), result)
+                                        for result in results]
+    return sorted(scored, key=lambda pair: -pair[0])
+
+
+def is_ambiguous(ranked: list[tuple[float, dict]], top_n: int = 2) -> bool:
+    """
+    This function is used to decide whether the ranking is too close to call without the model
+    :param ranked: ranked (score, result) pairs
+    :param top_n: number of results that will be picked
+    :return: True when the model should be consulted
+    """
+    if len(ranked) <= top_n:
+        return False
+    if ranked[top_n - 1][0] < MIN_CONFIDENT_SCORE:
+        return True
+    if ranked[top_n - 1][0] >= CLEAR_MATCH_SCORE:
+        return False
+    return ranked[top_n - 1][0] - ranked[top_n][0] < AMBIGUITY_MARGIN
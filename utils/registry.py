@@ -0,0 +1,192 @@
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional
+
+
+# ------------------resident memory helper------------------ #
+def resident_memory_bytes() -> int:
+    """
+    This helper function is used to read the resident set size of the current process
+    :return: resident memory in bytes
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages: int = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is a peak value (kB on linux), only used where /proc is unavailable
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# ------------------engine statistics------------------ #
+@dataclass
+class EngineStats:
+    key: tuple
+    load_seconds: float
+    resident_bytes: int
+    lightweight: bool = False
+    hits: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+
+# ------------------process-wide model registry------------------ #
+class ModelRegistry:
+    """
+    This class is used to load each model engine once per process and share it across Streamlit sessions.
+    Engines are kept in least-recently-used order and evicted when either the engine count or the memory
+    budget is exceeded. Lightweight engines (generation settings around shared weights, API clients) hold no
+    weights of their own, so they don't count toward either limit and are bounded by max_lightweight instead
+    """
+
+    def __init__(self, max_engines: int = 4, memory_budget_bytes: Optional[int] = None,
+                 max_lightweight: int = 32) -> None:
+        self.max_engines: int = max_engines
+        self.memory_budget_bytes: Optional[int] = memory_budget_bytes
+        self.max_lightweight: int = max_lightweight
+        self._engines: OrderedDict = OrderedDict()
+        self._stats: dict[tuple, EngineStats] = {}
+        self._lock: threading.RLock = threading.RLock()
+        self._load_locks: dict[tuple, threading.Lock] = {}
+
+    def get(self, key: tuple, loader: Callable[[], Any], footprint: Optional[Callable[[Any], int]] = None,
+            lightweight: bool = False) -> Any:
+        """
+        This function is used to return the engine stored under the key, loading it on first use
+        :param key: (model, temperature, max_tokens, device)
+        :param loader: callable that builds the engine
+        :param footprint: optional callable returning the engine size in bytes, defaults to the RSS delta
+        :param lightweight: the engine holds no weights of its own, its footprint is 0 even when its loader
+            loads the shared weights
+        :return: model engine
+        """
+        with self._lock:
+            if key in self._engines:
+                return self._touch(key)
+            load_lock: threading.Lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # only one thread loads a given key, the others wait and reuse the result
+        with load_lock:
+            with self._lock:
+                if key in self._engines:
+                    return self._touch(key)
+
+            rss_before: int = resident_memory_bytes()
+            start: float = time.perf_counter()
+            engine: Any = loader()
+            load_seconds: float = time.perf_counter() - start
+            if lightweight:
+                resident_bytes: int = 0
+            else:
+                resident_bytes: int = footprint(engine) if footprint else max(resident_memory_bytes() - rss_before, 0)
+
+            with self._lock:
+                self._engines[key] = engine
+                self._stats[key] = EngineStats(key=key, load_seconds=load_seconds, resident_bytes=resident_bytes,
+                                               lightweight=lightweight)
+                self._load_locks.pop(key, None)
+                self._enforce_limits(keep=key)
+
+        return engine
+
+    def clear(self) -> None:
+        with self._lock:
+            self._engines.clear()
+            self._stats.clear()
+
+    def stats(self) -> list[dict]:
+        """
+        This function is used to report the load time and resident memory of every loaded engine
+        :return: list of engine statistics
+        """
+        with self._lock:
+            return [
+                {
+                    "model": stat.key[0],
+                    "key": stat.key,
+                    "load_seconds": round(stat.load_seconds, 3),
+                    "resident_mb": round(stat.resident_bytes / 1024 ** 2, 1),
+                    "hits": stat.hits,
+                    "lightweight": stat.lightweight,
+                }
+                for stat in self._stats.values()
+            ]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._engines
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._engines)
+
+    def _touch(self, key: tuple) -> Any:
+        now: float = time.monotonic()
+        # using an engine built on shared weights keeps the weights from being evicted as well
+        weights_key: tuple = (key[0], None, None, key[-1])
+        if not self._is_weights_key(key) and weights_key in self._engines:
+            self._engines.move_to_end(weights_key)
+            self._stats[weights_key].last_used = now
+        self._engines.move_to_end(key)
+        stat: EngineStats = self._stats[key]
+        stat.hits += 1
+        stat.last_used = now
+        return self._engines[key]
+
+    def _resident_total(self) -> int:
+        return sum(stat.resident_bytes for stat in self._stats.values())
+
+    def _lightweight_keys(self, lightweight: bool) -> list[tuple]:
+        return [k for k in self._engines if k in self._stats and self._stats[k].lightweight == lightweight]
+
+    def _enforce_limits(self, keep: tuple) -> None:
+        def over_budget() -> bool:
+            if len(self._lightweight_keys(False)) > self.max_engines:
+                return True
+            return self.memory_budget_bytes is not None and self._resident_total() > self.memory_budget_bytes
+
+        while over_budget():
+            oldest: Optional[tuple] = next((k for k in self._lightweight_keys(False)
+                                            if not self._shares_weights(k, keep)), None)
+            if oldest is None:
+                break
+            self._drop(oldest)
+
+        while len(self._lightweight_keys(True)) > self.max_lightweight:
+            oldest = next((k for k in self._lightweight_keys(True) if k != keep), None)
+            if oldest is None:
+                break
+            self._drop(oldest)
+
+    @staticmethod
+    def _is_weights_key(key: tuple) -> bool:
+        # weights are registered without generation settings: (model, None, None, device)
+        return key[1] is None and key[2] is None
+
+    def _shares_weights(self, key: tuple, other: tuple) -> bool:
+        if key == other:
+            return True
+        return self._is_weights_key(key) and key[0] == other[0] and key[-1] == other[-1]
+
+    def _drop(self, key: tuple) -> None:
+        dependents: list[tuple] = [key]
+        if self._is_weights_key(key):
+            dependents += [k for k in self._engines if k[0] == key[0] and k[-1] == key[-1]]
+        for dependent in dependents:
+            self._engines.pop(dependent, None)
+            self._stats.pop(dependent, None)
+
+
+def _memory_budget_from_env() -> Optional[int]:
+    budget_mb: Optional[str] = os.getenv("MODEL_MEMORY_BUDGET_MB")
+    return int(budget_mb) * 1024 ** 2 if budget_mb else None
+
+
+# ------------------shared registry------------------ #
+model_registry: ModelRegistry = ModelRegistry(
+    max_engines=int(os.getenv("MODEL_REGISTRY_MAX_ENGINES", "4")),
+    memory_budget_bytes=_memory_budget_from_env()
+)
@@ -0,0 +1,192 @@
+import itertools
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Optional
+
+from utils.concurrency import backend_gate
+from utils.helper import model_backend
+from utils.telemetry import external_call, record_event, record_llm_call
+
+logger = logging.getLogger(__name__)
+
+# ------------------structured output settings------------------ #
+# candidate urls the local model can choose from, every ordered pair of them becomes an allowed completion
+STRUCTURED_MAX_CHOICES: int = int(os.getenv("STRUCTURED_MAX_CHOICES", "6"))
+URL_SELECTION_FUNCTION: str = "select_job_urls"
+
+repair_prompt_template: str = """
+Your previous reply could not be read: {reply}
+Choose the best {count} urls from this list: {candidates}
+Return ONLY a JSON array of the urls, do not include anything else;
+"""
+
+_code_fence: re.Pattern = re.compile(r"```(?:json)?")
+_json_array: re.Pattern = re.compile(r"\[[^\[\]]*\]", flags=re.DOTALL)
+_json_object: re.Pattern = re.compile(r"\{.*\}", flags=re.DOTALL)
+_url: re.Pattern = re.compile(r"https?://[^\s\"'<>\]\[,]+")
+
+
+# ------------------schema------------------ #
+def url_list_schema(candidates: list[str], count: int) -> dict:
+    """
+    This function is used to describe the reply of the url selection as a JSON schema, the urls are limited
+    to the search results so the model can't invent one
+    :param candidates: urls of the search results
+    :param count: number of urls to choose
+    :return: JSON schema
+    """
+    items: dict = {"type": "string", "enum": candidates} if candidates else {"type": "string"}
+    return {
+        "type": "object",
+        "properties": {"urls": {"type": "array", "items": items, "minItems": 1, "maxItems": count,
+                                "uniqueItems": True}},
+        "required": ["urls"],
+    }
+
+
+def url_array_choices(candidates: list[str], count: int) -> list[str]:
+    """
+    This helper function is used to spell out every reply the schema allows as JSON text, for constrained decoding
+    :param candidates: urls of the search results, best first
+    :param count: number of urls to choose
+    :return: list of JSON arrays
+    """
+    shortlist: list[str] = candidates[:STRUCTURED_MAX_CHOICES]
+    return [json.dumps(list(urls)) for urls in itertools.permutations(shortlist, min(count, len(shortlist)))]
+
+
+# ------------------constrained decoding------------------ #
+def choice_constraint(tokenizer: Any, choices: list[str], prompt_length: int) -> tuple[Callable, int]:
+    """
+    This function is used to build a prefix_allowed_tokens_fn for transformers generate that only lets the
+    model spell out one of the choices: the choices are tokenized into a trie and each step allows the
+    children of the node reached so far
+    :param tokenizer: huggingface tokenizer of the model
+    :param choices: allowed completions
+    :param prompt_length: number of prompt tokens in front of the generated ones
+    :return: (prefix_allowed_tokens_fn, max number of tokens of a choice)
+    """
+    eos_token_id: int = tokenizer.eos_token_id
+    trie: dict = {}
+    longest: int = 0
+    for choice in choices:
+        token_ids: list[int] = tokenizer.encode(choice, add_special_tokens=False) + [eos_token_id]
+        longest = max(longest, len(token_ids))
+        node: dict = trie
+        for token_id in token_ids:
+            node = node.setdefault(token_id, {})
+
+    def allowed_tokens(batch_id: int, input_ids: Any) -> list[int]:
+        node: Optional[dict] = trie
+        for token_id in input_ids[prompt_length:].tolist():
+            node = node.get(token_id)
+            if node is None:
+                return [eos_token_id]
+        return list(node) or [eos_token_id]
+
+    return allowed_tokens, longest
+
+
+# ------------------tolerant parsing------------------ #
+def _as_url_list(value: Any) -> list[str]:
+    if isinstance(value, dict):
+        value = value.get("urls", value.get("links", []))
+    if not isinstance(value, list):
+        return []
+    urls: list[str] = []
+    for item in value:
+        if isinstance(item, dict):
+            item = item.get("link") or item.get("url")
+        if isinstance(item, str):
+            urls.append(item.strip())
+    return urls
+
+
+def extract_url_list(text: Optional[str], candidates: list[str], count: int) -> Optional[list[str]]:
+    """
+    This function is used to read a url list out of a chatty reply: the reply is parsed as JSON, then the
+    first JSON array or object inside it, then any urls in the text. Only urls of the search results are kept
+    :param text: model reply
+    :param candidates: urls of the search results
+    :param count: number of urls to choose
+    :return: list of urls, None when the reply has none
+    """
+    if not text:
+        return None
+    text = _code_fence.sub("", text).strip()
+
+    urls: list[str] = []
+    for snippet in [text, *_json_array.findall(text), *_json_object.findall(text)]:
+        try:
+            urls = _as_url_list(json.loads(snippet))
+        except json.JSONDecodeError:
+            continue
+        if urls:
+            break
+    if not urls:
+        urls = [url.rstrip(".;:)") for url in _url.findall(text)]
+
+    allowed: set[str] = set(candidates)
+    urls = [url for url in dict.fromkeys(urls) if not allowed or url in allowed][:count]
+    return urls or None
+
+
+# ------------------structured completion------------------ #
+def _complete(llm: Any, model: str, prompt: str, candidates: list[str], count: int) -> str:
+    """
+    This helper function is used to ask the model for the url list in the strictest form its backend supports:
+    constrained decoding for local engines, function calling for OpenAI, plain text otherwise
+    :param llm: model engine
+    :param model: generative model
+    :param prompt: formatted prompt
+    :param candidates: urls of the search results
+    :param count: number of urls to choose
+    :return: model reply
+    """
+    backend: str = model_backend(model)
+    with backend_gate(backend), external_call(backend):
+        if hasattr(llm, "generate_constrained") and candidates:
+            reply: str = llm.generate_constrained(prompt, url_array_choices(candidates, count))
+        elif backend == "openai":
+            from langchain.schema import HumanMessage
+
+            function: dict = {"name": URL_SELECTION_FUNCTION, "description": "Return the urls of the best jobs",
+                              "parameters": url_list_schema(candidates, count)}
+            message: Any = llm.predict_messages([HumanMessage(content=prompt)], functions=[function],
+                                                function_call={"name": URL_SELECTION_FUNCTION})
+            reply: str = message.additional_kwargs.get("function_call", {}).get("arguments") or message.content
+        else:
+            reply: str = llm.predict(prompt)
+    record_llm_call(model, prompt, reply)
+    return reply
+
+
+def select_urls(llm: Any, model: str, prompt: str, candidates: list[str], count: int = 2) -> Optional[list[str]]:
+    """
+    This function is used to get a url list from the model that is safe to use. A reply that can't be read
+    gets one short repair call, and every unreadable reply is counted in structured_output_parse_failures_total
+    :param llm: model engine
+    :param model: generative model
+    :param prompt: formatted prompt
+    :param candidates: urls of the search results, best first
+    :param count: number of urls to choose
+    :return: list of urls, None when the repair call fails as well
+    """
+    backend: str = model_backend(model)
+    reply: str = _complete(llm, model, prompt, candidates, count)
+    urls: Optional[list[str]] = extract_url_list(reply, candidates, count)
+    if urls:
+        return urls
+
+    record_event("structured_output_parse_failures_total", backend=backend, attempt="first")
+    logger.warning("Unreadable url selection reply from %s: %.200s", model, reply)
+    repair_prompt: str = repair_prompt_template.format(reply=(reply or "")[:500], count=count,
+                                                       candidates=json.dumps(candidates))
+    reply = _complete(llm, model, repair_prompt, candidates, count)
+    urls = extract_url_list(reply, candidates, count)
+    if not urls:
+        record_event("structured_output_parse_failures_total", backend=backend, attempt="repair")
+        logger.warning("Unreadable url selection reply from %s after the repair call: %.200s", model, reply)
+    return urls
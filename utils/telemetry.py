@@ -0,0 +1,276 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, Optional
+
+metrics_logger = logging.getLogger("job_role_generator.metrics")
+
+# ------------------metrics log output------------------ #
+METRICS_LOG_LEVEL: str = os.getenv("METRICS_LOG_LEVEL", "INFO").upper()
+
+# ------------------estimated cost per 1k tokens (USD)------------------ #
+model_costs: dict = {
+    "gpt-3.5-turbo": {"prompt": 0.0010, "completion": 0.0020},
+}
+
+
+# ------------------per request trace------------------ #
+@dataclass
+class RequestTrace:
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: float = field(default_factory=time.time)
+    wall_seconds: float = 0.0
+    stages: list = field(default_factory=list)
+    external_calls: list = field(default_factory=list)
+    tokens: dict = field(default_factory=dict)
+    cache: dict = field(default_factory=dict)
+    cost_usd: float = 0.0
+    counters: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return asdict(self)
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+# ------------------process-wide aggregates------------------ #
+class MetricsRegistry:
+    """
+    This class is used to aggregate the traces of every request into Prometheus counters
+    """
+
+    def __init__(self, keep_traces: int = 50) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self.counters: dict[tuple, float] = defaultdict(float)
+        self.recent_traces: deque = deque(maxlen=keep_traces)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def render_prometheus(self) -> str:
+        """
+        This function is used to export the counters in the Prometheus text format
+        :return: metrics text
+        """
+        with self._lock:
+            items: list = sorted(self.counters.items())
+        lines: list[str] = []
+        declared: set[str] = set()
+        for (name, labels), value in items:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            label_text: str = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics: MetricsRegistry = MetricsRegistry()
+
+
+# ------------------recording------------------ #
+@contextmanager
+def request_trace(**attributes: Any) -> Iterator[RequestTrace]:
+    """
+    This function is used to trace one pipeline request, the trace is logged as JSON when it ends
+    :param attributes: extra attributes stored in the trace counters
+    :return: request trace
+    """
+    trace: RequestTrace = RequestTrace(counters=dict(attributes))
+    token: contextvars.Token = _current_trace.set(trace)
+    start: float = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as error:
+        trace.error = repr(error)
+        raise
+    finally:
+        trace.wall_seconds = round(time.perf_counter() - start, 4)
+        _current_trace.reset(token)
+        metrics.inc("pipeline_requests_total", status="error" if trace.error else "ok")
+        metrics.inc("pipeline_request_seconds_total", trace.wall_seconds)
+        metrics.recent_traces.append(trace.to_dict())
+        metrics_logger.info(json.dumps(trace.to_dict(), default=str))
+
+
+def traced(stage: str) -> Callable:
+    """
+    This decorator is used to record the wall time of a pipeline function in the current trace
+    :param stage: stage name
+    :return: decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start: float = time.perf_counter()
+            error: Optional[str] = None
+            try:
+                return function(*args, **kwargs)
+            except BaseException as exception:
+                error = repr(exception)
+                raise
+            finally:
+                seconds: float = time.perf_counter() - start
+                metrics.inc("pipeline_stage_seconds_total", seconds, stage=stage)
+                metrics.inc("pipeline_stage_calls_total", stage=stage, status="error" if error else "ok")
+                trace: Optional[RequestTrace] = current_trace()
+                if trace is not None:
+                    with trace._lock:
+                        trace.stages.append({"stage": stage, "seconds": round(seconds, 4), "error": error})
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def external_call(service: str) -> Iterator[None]:
+    """
+    This function is used to time a call to an external service (LinkedIn, Serper, job sites, model backends)
+    :param service: service name
+    :return: None
+    """
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds: float = time.perf_counter() - start
+        metrics.inc("external_call_seconds_total", seconds, service=service)
+        metrics.inc("external_calls_total", service=service)
+        trace: Optional[RequestTrace] = current_trace()
+        if trace is not None:
+            with trace._lock:
+                trace.external_calls.append({"service": service, "seconds": round(seconds, 4)})
+
+
+def record_tokens(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    This function is used to record token usage and the estimated cost of a model call
+    :param model: generative model
+    :param prompt_tokens: number of prompt tokens
+    :param completion_tokens: number of completion tokens
+    :return: estimated cost in USD
+    """
+    prices: dict = model_costs.get(model, {"prompt": 0.0, "completion": 0.0})
+    cost: float = (prompt_tokens * prices["prompt"] + completion_tokens * prices["completion"]) / 1000
+
+    metrics.inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+    metrics.inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+    metrics.inc("llm_cost_usd_total", cost, model=model)
+    trace: Optional[RequestTrace] = current_trace()
+    if trace is not None:
+        with trace._lock:
+            usage: dict = trace.tokens.setdefault(model, {"prompt": 0, "completion": 0})
+            usage["prompt"] += prompt_tokens
+            usage["completion"] += completion_tokens
+            trace.cost_usd = round(trace.cost_usd + cost, 6)
+    return cost
+
+
+def record_llm_call(model: str, prompt: str, completion: str) -> None:
+    """
+    This helper function is used to count the tokens of a model call with the model tokenizer and record them
+    :param model: generative model
+    :param prompt: formatted prompt
+    :param completion: generated text
+    :return: None
+    """
+    from utils.prompting import count_tokens
+
+    record_tokens(model, count_tokens(prompt, model), count_tokens(completion, model))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    This function is used to record a cache hit or miss
+    :param cache: cache name
+    :param hit: whether the value was found
+    :return: None
+    """
+    result: str = "hit" if hit else "miss"
+    metrics.inc("cache_lookups_total", cache=cache, result=result)
+    trace: Optional[RequestTrace] = current_trace()
+    if trace is not None:
+        with trace._lock:
+            cache_counts: dict = trace.cache.setdefault(cache, {"hit": 0, "miss": 0})
+            cache_counts[result] += 1
+
+
+def record_event(name: str, **labels: str) -> None:
+    """
+    This function is used to count an event such as a parse failure
+    :param name: counter name
+    :param labels: counter labels
+    :return: None
+    """
+    metrics.inc(name, **labels)
+    trace: Optional[RequestTrace] = current_trace()
+    if trace is not None:
+        with trace._lock:
+            trace.counters[name] = trace.counters.get(name, 0) + 1
+
+
+# ------------------metrics logging------------------ #
+@lru_cache(maxsize=1)
+def configure_metrics_logging(level: str = METRICS_LOG_LEVEL) -> Optional[logging.Handler]:
+    """
+    This function is used to write the metrics logger (per-request JSON traces, prompt token counts) to stderr,
+    once per process, whether or not the app configures logging. METRICS_LOG_LEVEL=OFF switches it off
+    :param level: log level of the metrics logger
+    :return: handler, None when switched off
+    """
+    if level == "OFF":
+        return None
+    handler: logging.Handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(handler)
+    metrics_logger.setLevel(level)
+    # the lines are already JSON, they aren't passed on to handlers with their own format
+    metrics_logger.propagate = False
+    return handler
+
+
+# ------------------prometheus endpoint------------------ #
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body: bytes = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@lru_cache(maxsize=1)
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """
+    This function is used to serve the Prometheus metrics on a port, once per process
+    :param port: port to listen on
+    :return: http server
+    """
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
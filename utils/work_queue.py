@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional
+
+from utils.telemetry import metrics, record_event
+
+# ------------------work queue settings------------------ #
+WORK_QUEUE_SLOTS: int = int(os.getenv("WORK_QUEUE_SLOTS", "2"))
+WORK_QUEUE_MAX_PENDING: int = int(os.getenv("WORK_QUEUE_MAX_PENDING", "32"))
+WORK_QUEUE_MAX_PER_SESSION: int = int(os.getenv("WORK_QUEUE_MAX_PER_SESSION", "2"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class QueuedJob:
+    key: Hashable
+    session: str
+    function: Callable[[], Any]
+    future: Future = field(default_factory=Future)
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    submitted_at: float = field(default_factory=time.perf_counter)
+    subscribers: int = 1
+
+
+# ------------------shared work queue------------------ #
+class WorkQueue:
+    """
+    This class is used to run pipeline jobs for every session on a fixed number of worker slots. Sessions are
+    served round-robin so one busy session can't starve the others, identical jobs share one run, and
+    submissions are refused once the queue is full
+    """
+
+    def __init__(self, slots: int = WORK_QUEUE_SLOTS, max_pending: int = WORK_QUEUE_MAX_PENDING,
+                 max_per_session: int = WORK_QUEUE_MAX_PER_SESSION) -> None:
+        self.slots: int = slots
+        self.max_pending: int = max_pending
+        self.max_per_session: int = max_per_session
+        self._sessions: OrderedDict[str, deque] = OrderedDict()
+        self._jobs: dict[Hashable, QueuedJob] = {}
+        self._running: int = 0
+        self._condition: threading.Condition = threading.Condition()
+        self._workers: list[threading.Thread] = []
+
+    def _start_workers(self) -> None:
+        # workers are started on first use, so importing the module doesn't spawn threads
+        while len(self._workers) < self.slots:
+            worker: threading.Thread = threading.Thread(target=self._work, name=f"work-queue-{len(self._workers)}",
+                                                        daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, session: str, key: Hashable, function: Callable[[], Any],
+               cancel_event: Optional[threading.Event] = None) -> Future:
+        """
+        This function is used to queue a job, a job with the same key that is already queued or running is
+        shared instead of being run twice
+        :param session: id of the submitting session
+        :param key: key identifying the job inputs
+        :param function: callable running the job
+        :param cancel_event: optional event the job checks to stop early, set once no session waits for the job
+        :return: future of the job result
+        """
+        with self._condition:
+            job: Optional[QueuedJob] = self._jobs.get(key)
+            if job is not None:
+                job.subscribers += 1
+                record_event("work_queue_jobs_total", result="shared")
+                return job.future
+
+            pending: int = sum(len(jobs) for jobs in self._sessions.values())
+            session_pending: int = len(self._sessions.get(session, ()))
+            if pending >= self.max_pending:
+                record_event("work_queue_jobs_total", result="rejected")
+                raise QueueFull(f"{pending} jobs are already waiting, try again shortly")
+            if session_pending >= self.max_per_session:
+                record_event("work_queue_jobs_total", result="rejected")
+                raise QueueFull(f"{session_pending} jobs of this session are already waiting")
+
+            job = QueuedJob(key=key, session=session, function=function)
+            if cancel_event is not None:
+                job.cancel_event = cancel_event
+            self._jobs[key] = job
+            self._sessions.setdefault(session, deque()).append(job)
+            record_event("work_queue_jobs_total", result="queued")
+            self._start_workers()
+            self._condition.notify()
+            return job.future
+
+    def release(self, future: Future) -> bool:
+        """
+        This function is used to give up on a job, once no session is waiting for it a queued job is dropped
+        and a running job is told to stop through its cancel event
+        :param future: future returned by submit
+        :return: True when no other session shares the job, so the job was dropped or told to stop
+        """
+        with self._condition:
+            job: Optional[QueuedJob] = next((job for job in self._jobs.values() if job.future is future), None)
+            if job is None:
+                return True
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return False
+            # the key is freed right away, so submitting the same inputs again starts a fresh job instead of
+            # getting the future of the run that is being given up on
+            del self._jobs[job.key]
+            job.cancel_event.set()
+            queued: Optional[deque] = self._sessions.get(job.session)
+            if queued is not None and job in queued:
+                queued.remove(job)
+                if not queued:
+                    del self._sessions[job.session]
+                job.future.cancel()
+            return True
+
+    def is_shared(self, future: Future, session: str) -> bool:
+        """
+        This function is used to tell whether a session is waiting for a job another session submitted, its
+        progress is only reported to the submitting session
+        :param future: future returned by submit
+        :param session: id of the waiting session
+        :return: True when the job runs for another session
+        """
+        with self._condition:
+            return any(job.future is future and job.session != session for job in self._jobs.values())
+
+    def position(self, future: Future) -> Optional[int]:
+        """
+        This function is used to tell a session how many jobs will start before its own
+        :param future: future returned by submit
+        :return: 1-based position in the dispatch order, None once the job is running or done
+        """
+        with self._condition:
+            order: list[QueuedJob] = self._dispatch_order()
+        for position, job in enumerate(order, start=1):
+            if job.future is future:
+                return position
+        return None
+
+    def _dispatch_order(self) -> list[QueuedJob]:
+        # one job per session per turn, in the same order _next_job hands them out
+        queues: list[list[QueuedJob]] = [list(jobs) for jobs in self._sessions.values()]
+        order: list[QueuedJob] = []
+        for turn in range(max((len(jobs) for jobs in queues), default=0)):
+            order += [jobs[turn] for jobs in queues if turn < len(jobs)]
+        return order
+
+    def _next_job(self) -> QueuedJob:
+        session, jobs = next(iter(self._sessions.items()))
+        job: QueuedJob = jobs.popleft()
+        del self._sessions[session]
+        if jobs:
+            # the session goes to the back of the line for its next job
+            self._sessions[session] = jobs
+        return job
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._sessions:
+                    self._condition.wait()
+                job: QueuedJob = self._next_job()
+                self._running += 1
+
+            metrics.inc("work_queue_wait_seconds_total", time.perf_counter() - job.submitted_at)
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.function())
+                    except BaseException as error:
+                        job.future.set_exception(error)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    if self._jobs.get(job.key) is job:
+                        del self._jobs[job.key]
+
+    def stats(self) -> dict:
+        """
+        This function is used to report how busy the queue is
+        :return: dict of queue counters
+        """
+        with self._condition:
+            return {"slots": self.slots, "running": self._running,
+                    "pending": sum(len(jobs) for jobs in self._sessions.values()), "sessions": len(self._sessions)}
+
+
+# ------------------process-wide queue, kept at module level so it survives streamlit reruns------------------ #
+pipeline_queue: WorkQueue = WorkQueue()